@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks for exifeditor.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+
+Usage:
+    python -m benchmarks.run --files 200 --tags 50 -o result.json
+    python -m benchmarks.compare old.json new.json
+"""
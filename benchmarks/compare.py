@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+""" Compare two benchmarks results.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import sys
+import json
+
+
+def compare(old, new, key='median'):
+    """ Compare results.
+
+    Returns:
+        list of (benchmark name, old time, new time, new/old ratio)
+    """
+    result = []
+    old_res, new_res = old['results'], new['results']
+    for name in sorted(set(old_res) | set(new_res)):
+        otime = old_res.get(name, {}).get(key)
+        ntime = new_res.get(name, {}).get(key)
+        ratio = ntime / otime if otime and ntime is not None else None
+        result.append((name, otime, ntime, ratio))
+    return result
+
+
+def _fmt(value, fmt):
+    return '-' if value is None else fmt % value
+
+
+def main():
+    if len(sys.argv) != 3:
+        print >> sys.stderr, "usage: %s OLD.json NEW.json" % sys.argv[0]
+        sys.exit(2)
+    with open(sys.argv[1]) as ifile:
+        old = json.load(ifile)
+    with open(sys.argv[2]) as ifile:
+        new = json.load(ifile)
+    if old.get('params') != new.get('params'):
+        print >> sys.stderr, "Warning: benchmarks params differ"
+    print "%-26s %10s %10s %8s" % ("benchmark", "old [s]", "new [s]",
+                                   "new/old")
+    for name, otime, ntime, ratio in compare(old, new):
+        print "%-26s %10s %10s %8s" % (name, _fmt(otime, '%.4f'),
+                                       _fmt(ntime, '%.4f'),
+                                       _fmt(ratio, '%.2f'))
+
+
+if __name__ == '__main__':
+    main()
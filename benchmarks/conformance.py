@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" Check values read by fastexif against GExiv2.
+
+Usage: python -m benchmarks.conformance [FILE or DIR ...]
+Without arguments generated corpus is checked.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import sys
+import shutil
+import logging
+import tempfile
+
+from benchmarks import corpus
+
+_LOG = logging.getLogger(__name__)
+
+# groups supported by fastexif
+_GROUPS = ('Exif.Image.', 'Exif.Photo.', 'Exif.GPSInfo.')
+
+
+def check_file(path):
+    """ Compare all supported tags read by fastexif and GExiv2.
+
+    Returns:
+        list of (tag, fastexif value, GExiv2 value) for different values
+    """
+    from gi.repository import GExiv2
+    from exifeditor.logic import fastexif
+    meta = GExiv2.Metadata(path)
+    expected = {tag: meta.get_tag_string(tag)
+                for tag in meta.get_exif_tags() if tag.startswith(_GROUPS)}
+    with fastexif.Metadata(path) as fmeta:
+        found = {tag: fmeta.get(tag) for tag in fmeta.get_tags()}
+    return [(tag, found.get(tag), expected.get(tag))
+            for tag in sorted(set(expected) | set(found))
+            if found.get(tag) != expected.get(tag)]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)-8s %(name)s - %(message)s")
+    from exifeditor.logic import batch
+    corpus_dir = None
+    if len(sys.argv) > 1:
+        files = list(batch.iter_files(sys.argv[1:]))
+    else:
+        corpus_dir = tempfile.mkdtemp(prefix='exifconf')
+        files = corpus.generate(corpus_dir, 20, 5)
+    errors = 0
+    try:
+        for path in files:
+            diffs = check_file(path)
+            for tag, found, expected in diffs:
+                print "%s: %s: fastexif=%r gexiv2=%r" % (path, tag, found,
+                                                        expected)
+            errors += bool(diffs)
+    finally:
+        if corpus_dir:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    print "Checked %d files; %d with differences" % (len(files), errors)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+""" Synthetic images corpus for benchmarks.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import random
+import struct
+import logging
+
+_LOG = logging.getLogger(__name__)
+
+# standard tags set for every file
+_BASE_TAGS = (
+    ('Exif.Image.Make', 'Benchmark'),
+    ('Exif.Image.Model', 'Model %(model)d'),
+    ('Exif.Image.Artist', 'Artist %(num)d'),
+    ('Exif.Image.Copyright', 'Copyright %(num)d'),
+    ('Exif.Image.ImageDescription', 'Description of image %(num)d'),
+    ('Exif.Image.DateTime', '2014:12:%(day)02d 12:00:00'),
+    ('Exif.Photo.DateTimeOriginal', '2014:12:%(day)02d 12:00:00'),
+    ('Exif.Photo.ISOSpeedRatings', '%(iso)d'),
+    ('Exif.Photo.ExposureTime', '1/%(exposure)d'),
+    ('Exif.Photo.FNumber', '%(fnumber)d/10'),
+)
+
+
+def write_tiff(path, width, height, rnd):
+    """ Write uncompressed 8-bit RGB TIFF file. """
+    strip = bytearray(rnd.getrandbits(8) for _ in xrange(width * 3))
+    data_size = width * height * 3
+    entries = [
+        (256, 4, 1, width),  # ImageWidth
+        (257, 4, 1, height),  # ImageLength
+        (258, 3, 3, None),  # BitsPerSample -> offset
+        (259, 3, 1, 1),  # Compression: none
+        (262, 3, 1, 2),  # Photometric: RGB
+        (273, 4, 1, None),  # StripOffsets -> offset
+        (277, 3, 1, 3),  # SamplesPerPixel
+        (278, 4, 1, height),  # RowsPerStrip
+        (279, 4, 1, data_size),  # StripByteCounts
+    ]
+    ifd_offset = 8
+    ifd_size = 2 + len(entries) * 12 + 4
+    bps_offset = ifd_offset + ifd_size
+    data_offset = bps_offset + 6
+    with open(path, 'wb') as out:
+        out.write('II*\x00' + struct.pack('<I', ifd_offset))
+        out.write(struct.pack('<H', len(entries)))
+        for tag, ftype, count, value in entries:
+            if tag == 258:
+                value = bps_offset
+            elif tag == 273:
+                value = data_offset
+            if ftype == 3 and count == 1:
+                out.write(struct.pack('<HHIHH', tag, ftype, count, value, 0))
+            else:
+                out.write(struct.pack('<HHII', tag, ftype, count, value))
+        out.write(struct.pack('<I', 0))
+        out.write(struct.pack('<HHH', 8, 8, 8))
+        for _row in xrange(height):
+            out.write(strip)
+
+
+def write_jpeg(path, width, height, rnd):
+    """ Write JPEG file; require PyQt4. """
+    from PyQt4 import QtGui
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(rnd.getrandbits(24))
+    if not image.save(path, 'JPG'):
+        raise IOError("can't write %s" % path)
+
+
+def set_tags(path, num, tags_count, rnd):
+    """ Set standard tags and `tags_count` additional xmp tags. """
+    from exifeditor.logic import exif
+    meta = exif._metadata(path)  # pylint: disable=W0212
+    params = {'num': num, 'model': num % 5, 'day': num % 28 + 1,
+              'iso': rnd.choice((100, 200, 400, 800, 1600, 3200, 6400)),
+              'exposure': rnd.choice((30, 60, 125, 250, 500, 1000)),
+              'fnumber': rnd.choice((14, 20, 28, 40, 56, 80))}
+    for tag, value in _BASE_TAGS:
+        meta[tag] = value % params
+    for tnum in xrange(tags_count):
+        meta['Xmp.xmp.BenchTag%04d' % tnum] = 'value %d %d' % (num, tnum)
+    meta.save_file()
+
+
+def generate(directory, files=100, tags=50, width=640, height=480,
+             formats=('jpg', 'tif'), seed=0):
+    """ Generate corpus in `directory`.
+
+    Args:
+        directory: destination directory (created when not exists)
+        files: number of files
+        tags: number of additional tags in each file
+        width, height: images size
+        formats: list of files formats (jpg, tif)
+        seed: random generator seed
+
+    Returns:
+        list of generated files
+    """
+    rnd = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    writers = {'jpg': write_jpeg, 'tif': write_tiff}
+    result = []
+    for num in xrange(files):
+        fmt = formats[num % len(formats)]
+        path = os.path.join(directory, 'bench%06d.%s' % (num, fmt))
+        writers[fmt](path, width, height, rnd)
+        set_tags(path, num, tags, rnd)
+        result.append(path)
+    _LOG.info("generated %d files in %s", files, directory)
+    return result
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+""" Run benchmarks and write results as json.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import optparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks import corpus
+
+_LOG = logging.getLogger(__name__)
+
+
+def _stats(times):
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+    }
+
+
+class Benchmark(object):
+    """ Timing of operations on corpus.
+
+    Args:
+        files: list of corpus files
+        repeat: number of runs of each operation
+        startup_target: expected application startup time in seconds
+    """
+
+    def __init__(self, files, repeat=3, startup_target=None):
+        self.files = files
+        self.repeat = repeat
+        self.startup_target = startup_target
+        self.results = {}
+
+    def measure(self, name, func, setup=None):
+        """ Run `func` `repeat` times; `setup` result is passed to `func`
+        and is not measured. """
+        times = []
+        for _run in xrange(self.repeat):
+            arg = setup() if setup else None
+            start = time.time()
+            func(arg)
+            times.append(time.time() - start)
+        self.results[name] = _stats(times)
+        _LOG.info("%-24s median=%.4fs", name, self.results[name]['median'])
+
+    def run_all(self):
+        """ Run all benchmarks; GUI benchmarks are skipped without X
+        display. """
+        if os.environ.get('DISPLAY'):
+            self.measure_startup()
+            self._measure_tree_model()
+        else:
+            _LOG.warn("DISPLAY not set; skipping GUI benchmarks (startup, "
+                      "tree model) - run under Xvfb, i.e. "
+                      "'xvfb-run make bench'")
+        return self.run_logic()
+
+    def run_logic(self):
+        """ Run benchmarks of non-GUI operations. """
+        from exifeditor.logic import exif, fastexif, filelist
+
+        self.measure("image_init",
+                     lambda _arg: [exif.Image(fname) for fname in self.files])
+
+        self.measure("read_tags_gexiv2",
+                     lambda _arg: [exif.read_tags(fname, filelist.SORT_TAGS)
+                                   for fname in self.files])
+
+        def read_tags_fast(_arg):
+            for fname in self.files:
+                with fastexif.Metadata(fname) as metadata:
+                    exif.read_tags(fname, filelist.SORT_TAGS, metadata)
+
+        self.measure("read_tags_fastexif", read_tags_fast)
+
+        def get_values(images):
+            for image in images:
+                for tag in image.get_tags():
+                    image.get_value(tag)
+
+        self.measure("get_value_all_tags", get_values,
+                     lambda: [exif.Image(fname) for fname in self.files])
+
+        tags = ('Exif.Image.Artist', 'Exif.Image.Copyright')
+        counter = [0]
+
+        def prepare_copy():
+            # change source values so each run modify all files
+            counter[0] += 1
+            flist = filelist.FileList()
+            src = flist.get_exif(self.files[0])
+            for tag in tags:
+                src.set_value(tag, 'bench %d' % counter[0])
+            return flist
+
+        self.measure("filelist_copy_exif_tag",
+                     lambda flist: flist.copy_exif_tag(
+                         self.files[0], self.files[1:], tags),
+                     prepare_copy)
+
+        def prepare_save():
+            flist = prepare_copy()
+            flist.copy_exif_tag(self.files[0], self.files[1:], tags)
+            return flist
+
+        self.measure("filelist_save", lambda flist: flist.save(),
+                     prepare_save)
+        return self.results
+
+    def measure_startup(self):
+        """ Measure time from start of process to shown main window
+        with corpus directory.
+
+        Each run use new, empty home and cache directory, so metadata index
+        and thumbnails from previous runs (or user's) are not used and not
+        changed.
+        """
+        directory = os.path.dirname(self.files[0])
+        topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        times, shown = [], []
+        for _run in xrange(self.repeat):
+            home = tempfile.mkdtemp(prefix='exifhome')
+            env = dict(os.environ, HOME=home,
+                       XDG_CACHE_HOME=os.path.join(home, '.cache'),
+                       XDG_CONFIG_HOME=os.path.join(home, '.config'))
+            try:
+                start = time.time()
+                proc = subprocess.Popen([sys.executable, '-m',
+                                         'benchmarks.startup', directory],
+                                        stdout=subprocess.PIPE, cwd=topdir,
+                                        env=env)
+                out, _err = proc.communicate()
+                elapsed = time.time() - start
+            finally:
+                shutil.rmtree(home, ignore_errors=True)
+            if proc.returncode:
+                _LOG.warn("startup benchmark failed (code %d); skipping",
+                          proc.returncode)
+                return
+            times.append(elapsed)
+            shown.append(json.loads(out)['window_shown'])
+        stats = self.results['startup'] = _stats(times)
+        stats['window_shown'] = _stats(shown)['median']
+        if self.startup_target:
+            stats['target'] = self.startup_target
+            stats['target_met'] = stats['median'] <= self.startup_target
+        _LOG.info("%-24s median=%.4fs target=%s", 'startup',
+                  stats['median'], self.startup_target)
+
+    def _measure_tree_model(self):
+        try:
+            from PyQt4 import QtCore, QtGui
+        except ImportError:
+            _LOG.warn("PyQt4 not available; skipping tree model benchmark")
+            return
+        app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+        assert app
+        from exifeditor.gui import _models
+        from exifeditor.logic import exif
+
+        def update_model(images):
+            model = _models.ExifTreeModel()
+            root = QtCore.QModelIndex()
+            for image in images:
+                model.update(image)
+                # fetch and read all visible data
+                for row in xrange(model.rowCount(root)):
+                    group = model.index(row, 0, root)
+                    model.fetchMore(group)
+                    for trow in xrange(model.rowCount(group)):
+                        for col in (0, 1):
+                            model.data(model.index(trow, col, group),
+                                       QtCore.Qt.DisplayRole)
+
+        self.measure("tree_model_update", update_model,
+                     lambda: [exif.Image(fname) for fname in self.files])
+
+
+def _parse_opt():
+    optp = optparse.OptionParser(usage="%prog [options]")
+    optp.add_option("--files", type="int", default=100,
+                    help="number of files in corpus (default 100)")
+    optp.add_option("--tags", type="int", default=50,
+                    help="number of additional tags in file (default 50)")
+    optp.add_option("--width", type="int", default=640)
+    optp.add_option("--height", type="int", default=480)
+    optp.add_option("--formats", default="jpg,tif",
+                    help="files formats (default jpg,tif)")
+    optp.add_option("--repeat", type="int", default=3,
+                    help="number of runs of each benchmark (default 3)")
+    optp.add_option("--seed", type="int", default=0)
+    optp.add_option("--startup-target", type="float", default=1.0,
+                    help="expected startup time in seconds (default 1.0)")
+    optp.add_option("--corpus-dir",
+                    help="corpus directory (default: temporary directory)")
+    optp.add_option("--output", "-o", help="result file (default: stdout)")
+    return optp.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)-8s %(name)s - %(message)s")
+    options, _args = _parse_opt()
+    corpus_dir = options.corpus_dir or tempfile.mkdtemp(prefix='exifbench')
+    params = {'files': options.files, 'tags': options.tags,
+              'width': options.width, 'height': options.height,
+              'formats': options.formats, 'repeat': options.repeat,
+              'seed': options.seed,
+              'startup_target': options.startup_target}
+    try:
+        files = corpus.generate(corpus_dir, options.files, options.tags,
+                                options.width, options.height,
+                                options.formats.split(','), options.seed)
+        bench = Benchmark(files, options.repeat, options.startup_target)
+        results = bench.run_all()
+    finally:
+        if not options.corpus_dir:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    output = {
+        'params': params,
+        'platform': {'python': platform.python_version(),
+                     'system': platform.platform()},
+        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as ofile:
+            json.dump(output, ofile, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
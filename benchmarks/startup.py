@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+""" Measure application startup.
+
+Run in separate process by `benchmarks.run`: create main window for
+directory given as argument, wait until it is shown and write timings
+(seconds from script start) as json to stdout.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import sys
+import time
+import json
+
+
+def main():
+    start = time.time()
+    timings = {}
+
+    from exifeditor.lib import appconfig
+    config = appconfig.AppConfig("exifeditor.cfg", "exifeditor")
+    config.load_defaults(config.get_data_file("defaults.cfg"))
+    config.load()
+
+    from PyQt4 import QtGui
+    app = QtGui.QApplication(sys.argv[:1])
+    timings['qt_init'] = time.time() - start
+
+    from exifeditor.gui import main_wnd
+    timings['gui_import'] = time.time() - start
+
+    window = main_wnd.MainWnd(sys.argv[1:])
+    window.show()
+    app.processEvents()
+    timings['window_shown'] = time.time() - start
+    timings['gexiv2_loaded'] = 'gi.repository.GExiv2' in sys.modules
+
+    json.dump(timings, sys.stdout)
+    sys.stdout.flush()
+    # skip closing window (asks for confirmation) and saving config
+    os._exit(0)  # pylint: disable=W0212
+
+
+if __name__ == '__main__':
+    main()
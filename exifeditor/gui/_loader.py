@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+""" Background image loader.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import logging
+
+from PyQt4 import QtCore, QtGui
+
+from exifeditor.lib import profiling
+
+_LOG = logging.getLogger(__name__)
+
+
+class _LoadTask(QtCore.QRunnable):
+    """ Load exif and preview for one file. """
+
+    def __init__(self, loader, generation, path, width, height, load_image):
+        super(_LoadTask, self).__init__()
+        self._loader = loader
+        self._generation = generation
+        self._path = path
+        self._width = width
+        self._height = height
+        self._load_image = load_image
+
+    def _cancelled(self):
+        return self._generation != self._loader.generation
+
+    def run(self):
+        loader = self._loader
+        if self._cancelled():
+            return
+        try:
+            image = loader.filelist.get_exif(self._path)
+        except Exception, err:  # pylint: disable=W0703
+            _LOG.exception("_LoadTask: load exif %r error", self._path)
+            loader.load_error.emit(self._generation, self._path, str(err))
+            return
+        loader.exif_loaded.emit(self._generation, image)
+        if not self._load_image or self._cancelled():
+            return
+        thumb = self._load_thumbnail(image)
+        if self._cancelled():
+            return
+        if not thumb.isNull():
+            thumb = thumb.scaled(self._width, self._height,
+                                 QtCore.Qt.KeepAspectRatio)
+        loader.image_loaded.emit(self._generation, self._path, thumb)
+
+    def _load_thumbnail(self, image):
+        """ Load image for preview; use shared thumbnails or preview
+        embedded in exif when possible. """
+        size = max(self._width, self._height)
+        thumbnails = self._loader.thumbnails
+        if thumbnails:
+            thumb = thumbnails.load(self._path, size)
+            if thumb is not None:
+                return thumb
+        thumb = None
+        try:
+            preview = image.get_preview(self._width, self._height)
+        except Exception:  # pylint: disable=W0703
+            _LOG.exception("_LoadTask: get preview error")
+            preview = None
+        if preview:
+            with profiling.timer("thumbnail.decode_preview"):
+                thumb = QtGui.QImage.fromData(preview[1])
+        if thumb is None or thumb.isNull():
+            # no suitable preview; decode whole file
+            with profiling.timer("thumbnail.decode_file"):
+                thumb = QtGui.QImage(self._path)
+        if thumbnails:
+            thumbnails.store(self._path, thumb, size)
+        return thumb
+
+
+class ImageLoader(QtCore.QObject):
+    """ Load exif and preview images in background threads.
+
+    Each request get new generation id; results of previous requests are
+    dropped.
+
+    Signals:
+        exif_loaded(generation, exif.Image)
+        image_loaded(generation, path, QImage)
+        load_error(generation, path, error message)
+    """
+
+    exif_loaded = QtCore.pyqtSignal(int, object)
+    image_loaded = QtCore.pyqtSignal(int, object, object)
+    load_error = QtCore.pyqtSignal(int, object, object)
+
+    def __init__(self, filelist, thumbnails, parent=None):
+        super(ImageLoader, self).__init__(parent)
+        self.filelist = filelist
+        self.thumbnails = thumbnails
+        self.generation = 0
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+
+    def load(self, path, width, height, load_image=True):
+        """ Start loading `path`; cancel previous requests.
+
+        Args:
+            path: image path
+            width, height: size of preview
+            load_image: if False - load only exif
+
+        Returns:
+            generation id of request
+        """
+        self.generation += 1
+        self._pool.start(_LoadTask(self, self.generation, path, width,
+                                   height, load_image))
+        return self.generation
+
+    def cancel(self):
+        """ Drop results of all pending requests. """
+        self.generation += 1
+
+    def close(self):
+        self.cancel()
+        self._pool.waitForDone()
+
+
+class _SortKeysTask(QtCore.QRunnable):
+    """ Load sort keys for part of files. """
+
+    # number of files reported in one signal
+    CHUNK_SIZE = 100
+
+    def __init__(self, loader, generation, paths):
+        super(_SortKeysTask, self).__init__()
+        self._loader = loader
+        self._generation = generation
+        self._paths = paths
+
+    def run(self):
+        loader = self._loader
+        chunk = []
+        for path in self._paths:
+            if self._generation != loader.generation:
+                return
+            chunk.append((path, loader.filelist.get_sort_keys(path)))
+            if len(chunk) >= self.CHUNK_SIZE:
+                loader.keys_loaded.emit(self._generation, chunk)
+                chunk = []
+        if chunk:
+            loader.keys_loaded.emit(self._generation, chunk)
+        loader.task_done.emit(self._generation)
+
+
+class SortKeysLoader(QtCore.QObject):
+    """ Read sort keys (FileList.get_sort_keys) in background threads.
+
+    Signals:
+        keys_loaded(generation, [(path, keys)])
+        finished(generation): all keys for request loaded
+    """
+
+    keys_loaded = QtCore.pyqtSignal(int, object)
+    finished = QtCore.pyqtSignal(int)
+    task_done = QtCore.pyqtSignal(int)
+
+    def __init__(self, filelist, workers=2, parent=None):
+        super(SortKeysLoader, self).__init__(parent)
+        self.filelist = filelist
+        self.generation = 0
+        self._pending = 0
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(workers)
+        self.task_done.connect(self._on_task_done)
+
+    def load(self, paths):
+        """ Start loading keys for `paths`; cancel previous request.
+
+        Returns:
+            generation id of request
+        """
+        self.generation += 1
+        workers = self._pool.maxThreadCount()
+        self._pending = min(workers, len(paths))
+        for idx in xrange(self._pending):
+            self._pool.start(_SortKeysTask(self, self.generation,
+                                           paths[idx::workers]))
+        return self.generation
+
+    def _on_task_done(self, generation):
+        if generation == self.generation:
+            self._pending -= 1
+            if not self._pending:
+                self.finished.emit(generation)
+
+    def cancel(self):
+        """ Drop results of pending request. """
+        self.generation += 1
+
+    def close(self):
+        self.cancel()
+        self._pool.waitForDone()
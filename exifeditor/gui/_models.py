@@ -12,24 +12,41 @@ __copyright__ = u"Copyright (c) Karol Będkowski, 2014"
 __version__ = "2014-11-11"
 
 
+import os
+import time
+import array
 import logging
 import textwrap
 
 from PyQt4 import QtCore, QtGui
 
+from exifeditor.lib import profiling
+from exifeditor.logic import filelist as mfilelist
+
 
 _LOG = logging.getLogger(__name__)
 
 
+# labels and tooltips shared by all nodes for given tag
+_TAG_LABELS = {}
+_TAG_TOOLTIPS = {}
+
+
 class ExifTreeNode(object):
-    def __init__(self, parent, image, key, label):
+    __slots__ = ('children', 'parent', 'image', 'key', '_label', '_row')
+
+    # defaults for nodes without value
+    value = None
+    exif_val = None
+    modified = False
+
+    def __init__(self, parent, image, key, label, row=0):
         self.children = []
         self.parent = parent
         self.image = image
         self.key = key
-        self.label = label
-        self.value = None
-        self.tooltip = QtCore.QVariant(key)
+        self._label = label
+        self._row = row
 
     def __len__(self):
         return len(self.children)
@@ -41,8 +58,12 @@ class ExifTreeNode(object):
         return "<%s %s; %r; clen=%d>" % (self.__class__.__name__,
                                          self.key, self.label, len(self))
 
+    @property
+    def label(self):
+        return self._label
+
     def get_tooltip(self):
-        return self.tooltip
+        return self.key
 
     def clear(self):
         for child in self.children:
@@ -57,35 +78,72 @@ class ExifTreeNode(object):
 
     def row(self):
         """The position of this node in the parent's list of children."""
-        return self.parent.children.index(self) if self.parent else 0
+        return self._row
 
     def setData(self, _column, _value):
         return False
 
 
 class ExifGroupTreeNode(ExifTreeNode):
-    """ Group node """
-    pass
+    """ Group node; children are created on demand """
+    __slots__ = ('fetched', )
+
+    def __init__(self, parent, image, key, label, row=0):
+        super(ExifGroupTreeNode, self).__init__(parent, image, key, label,
+                                                row)
+        self.fetched = False
+
+    def fetch(self, tags):
+        """ Create children nodes for `tags`. """
+        self.fetched = True
+        self.children = [ExifValueTreeNode(self, self.image, itag, row)
+                         for row, itag in enumerate(tags)]
 
 
 class ExifValueTreeNode(ExifTreeNode):
-    """ Group node """
-    def __init__(self, parent, image, key):
-        super(ExifValueTreeNode, self).__init__(parent, image, key, None)
+    """ Tag node; label and value are decoded on first use """
+    __slots__ = ('modified', '_exif_val', '_value', '_loaded')
+
+    def __init__(self, parent, image, key, row=0):
+        super(ExifValueTreeNode, self).__init__(parent, image, key, None,
+                                                row)
         self.modified = False
-        self.exif_val = None
-        self.label = image.get_tag_label(key)
-        self.tooltip = None
-        self.update()
+        self._exif_val = self._value = None
+        self._loaded = False
 
     def get_tooltip(self):
-        if not self.tooltip:
-            self.tooltip = self.key + '\n' + \
+        tooltip = _TAG_TOOLTIPS.get(self.key)
+        if tooltip is None:
+            tooltip = _TAG_TOOLTIPS[self.key] = self.key + '\n' + \
                     textwrap.fill(self.image.get_tag_descr(self.key), 100)
-        return self.tooltip
+        return tooltip
+
+    @property
+    def label(self):
+        if self._label is None:
+            label = _TAG_LABELS.get(self.key)
+            if label is None:
+                label = _TAG_LABELS[self.key] = \
+                        self.image.get_tag_label(self.key)
+            self._label = label
+        return self._label
+
+    @property
+    def value(self):
+        if not self._loaded:
+            self.update()
+        return self._value
+
+    @property
+    def exif_val(self):
+        if not self._loaded:
+            self.update()
+        return self._exif_val
 
     def update(self):
-        self.exif_val, self.value = self.image.get_value(self.key)
+        self._exif_val, self._value = self.image.get_value(self.key) \
+            or (None, None)
+        self._loaded = True
 
     def setData(self, column, value):
         value = unicode(value)
@@ -102,20 +160,133 @@ class ExifTreeModel(QtCore.QAbstractItemModel):
     def __init__(self, parent=None):
         super(ExifTreeModel, self).__init__(parent)
         self.root = ExifTreeNode(None, None, 'root', None)
+        self.image = None
         self.update(None)
 
+    @profiling.timed("ExifTreeModel.update")
     def update(self, image):
-        """ Refresh whole tree model from database. """
+        """ Refresh tree model.
+
+        When `image` is the same file as currently displayed - only changed
+        rows are updated. Otherwise whole tree is rebuild; only group nodes
+        are created; tags are loaded by `fetchMore`.
+
+        Returns:
+            True when whole tree was rebuild.
+        """
+        if image is not None and self.image is not None and \
+                image.path == self.image.path:
+            self._refresh(image)
+            return False
         self.emit(QtCore.SIGNAL("layoutAboutToBeChanged()"))
         self.root.clear()
+        self.image = image
         if image:
-            for tag, tag_label in image.get_groups():
-                group = ExifGroupTreeNode(self.root, image, tag, tag_label)
-                group.children = [ExifValueTreeNode(group, image, itag)
-                                for itag
-                                in sorted(image.get_tags_by_group(tag))]
-                self.root.children.append(group)
+            self.root.children = [ExifGroupTreeNode(self.root, image, tag,
+                                                    tag_label, row)
+                                  for row, (tag, tag_label)
+                                  in enumerate(image.get_groups())]
         self.emit(QtCore.SIGNAL("layoutChanged()"))
+        return True
+
+    def _refresh(self, image):
+        """ Update tree to current state of `image`; emit signals only for
+        changed rows. """
+        self.image = image
+        labels = dict(image.get_groups())
+        self._sync_children(
+            QtCore.QModelIndex(), self.root, image.groups,
+            lambda key, row: ExifGroupTreeNode(self.root, image, key,
+                                               labels[key], row))
+        for group in self.root.children:
+            group.image = image
+            if not group.fetched:
+                continue
+            group_idx = self.createIndex(group.row(), 0, group)
+            self._sync_children(
+                group_idx, group, image.get_tags_by_group(group.key),
+                lambda key, row, group=group: ExifValueTreeNode(
+                    group, image, key, row))
+            for node in group.children:
+                node.image = image
+                if self._refresh_node(node, image):
+                    self.dataChanged.emit(
+                        self.createIndex(node.row(), 0, node),
+                        self.createIndex(node.row(), 1, node))
+
+    @staticmethod
+    def _refresh_node(node, image):
+        """ Reload value of `node`; return True when changed. """
+        changed = False
+        if node.modified and not image.updated:
+            # image saved
+            node.modified = False
+            changed = True
+        if node._loaded:  # pylint: disable=W0212
+            old_value = (node.exif_val, node.value)
+            node.update()
+            changed |= old_value != (node.exif_val, node.value)
+        return changed
+
+    def _sync_children(self, parent_idx, node, keys, create_node):
+        """ Remove children of `node` that key is not in `keys`, insert
+        nodes for new keys.
+
+        Both node children and `keys` must be in the same order.
+        """
+        children = node.children
+        valid = set(keys)
+        # remove
+        row = len(children) - 1
+        while row >= 0:
+            if children[row].key in valid:
+                row -= 1
+                continue
+            last = row
+            while row > 0 and children[row - 1].key not in valid:
+                row -= 1
+            self.beginRemoveRows(parent_idx, row, last)
+            del children[row:last + 1]
+            self._renumber(children, row)
+            self.endRemoveRows()
+            row -= 1
+        # insert
+        row = 0
+        while row < len(keys):
+            if row < len(children) and children[row].key == keys[row]:
+                row += 1
+                continue
+            first = row
+            while row < len(keys) and (first >= len(children) or
+                                       children[first].key != keys[row]):
+                row += 1
+            self.beginInsertRows(parent_idx, first, row - 1)
+            children[first:first] = [create_node(key, first + num)
+                                     for num, key
+                                     in enumerate(keys[first:row])]
+            self._renumber(children, row)
+            self.endInsertRows()
+
+    @staticmethod
+    def _renumber(children, start):
+        for row in xrange(start, len(children)):
+            children[row]._row = row  # pylint: disable=W0212
+
+    def canFetchMore(self, index):
+        node = self.node_from_index(index)
+        return isinstance(node, ExifGroupTreeNode) and not node.fetched
+
+    def fetchMore(self, index):
+        node = self.node_from_index(index)
+        if not isinstance(node, ExifGroupTreeNode) or node.fetched:
+            return
+        tags = node.image.get_tags_by_group(node.key)
+        if not tags:
+            node.fetched = True
+            return
+        self.beginInsertRows(index, 0, len(tags) - 1)
+        node.fetch(tags)
+        self.endInsertRows()
 
     def data(self, index, role):
         """Returns the data stored under the given role for the item referred
@@ -180,7 +351,10 @@ class ExifTreeModel(QtCore.QAbstractItemModel):
         """Finds out if a node has children."""
         if not index.isValid():
             return True
-        return len(self.node_from_index(index).children) > 0
+        node = self.node_from_index(index)
+        if isinstance(node, ExifGroupTreeNode) and not node.fetched:
+            return True
+        return len(node.children) > 0
 
     def index(self, row, column, parent):
         """Creates an index in the model for a given node and returns it."""
@@ -218,17 +392,275 @@ class ExifTreeModel(QtCore.QAbstractItemModel):
         return result
 
 
-class MyFileSystemModel(QtGui.QFileSystemModel):
-    def __init__(self, filelist, *argv, **kwargs):
+class FileListModel(QtCore.QAbstractTableModel):
+    """ Images in one directory.
+
+    Files are searched in background (QTimer) and added in chunks. Rows
+    are kept in flat arrays; size and modification time are read when
+    first needed.
+
+    When `sort_field` is set, additional column with value of
+    filelist.SORT_TAGS[sort_field] is shown; values are taken from
+    FileList sort keys cache and must be loaded before (see
+    `sort_keys_loaded`).
+
+    Signals:
+        directory_loaded(path): all files in directory found
+    """
+
+    directory_loaded = QtCore.pyqtSignal(object)
+
+    COLUMNS = ("Name", "Size", "Date Modified")
+    # titles of sort fields (for filelist.SORT_TAGS)
+    SORT_FIELDS = ("Date Taken", "Camera", "Lens")
+    FIELD_COLUMN = len(COLUMNS)
+    # number of files added in one step
+    CHUNK_SIZE = 500
+    # min interval between sorting when loading sort keys (ms)
+    RESORT_INTERVAL = 1000
+
+    def __init__(self, filelist, parent=None):
+        super(FileListModel, self).__init__(parent)
         self._filelist = filelist
-        super(MyFileSystemModel, self).__init__(*argv, **kwargs)
+        self.path = None
+        self._names = []
+        self._sizes = array.array('d')  # -1 = not read yet
+        self._mtimes = array.array('d')
+        self._scanner = None
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._scan_chunk)
+        self._sort_column = 0
+        self._sort_order = QtCore.Qt.AscendingOrder
+        self.sort_field = None
+        self._resort_timer = QtCore.QTimer(self)
+        self._resort_timer.setSingleShot(True)
+        self._resort_timer.setInterval(self.RESORT_INTERVAL)
+        self._resort_timer.timeout.connect(self._resort)
+        # row -> is file updated; valid for `_bold_version`
+        self._bold_rows = {}
+        self._bold_version = None
+
+    def set_directory(self, path):
+        """ Show images from directory `path`. """
+        self._timer.stop()
+        self.beginResetModel()
+        self.path = path
+        self._names = []
+        self._sizes = array.array('d')
+        self._mtimes = array.array('d')
+        self._bold_rows.clear()
+        self.endResetModel()
+        self._scanner = mfilelist.scan_images(path)
+        self._timer.start(0)
+
+    def _scan_chunk(self):
+        """ Add next `CHUNK_SIZE` files to model. """
+        names = []
+        try:
+            for name in self._scanner:
+                names.append(name)
+                if len(names) >= self.CHUNK_SIZE:
+                    break
+            else:
+                self._scanner = None
+        except (IOError, OSError), err:
+            _LOG.warn("FileListModel: scan %r error: %s", self.path, err)
+            self._scanner = None
+        if names:
+            first = len(self._names)
+            self.beginInsertRows(QtCore.QModelIndex(), first,
+                                 first + len(names) - 1)
+            self._names.extend(names)
+            self._sizes.extend([-1] * len(names))
+            self._mtimes.extend([-1] * len(names))
+            self.endInsertRows()
+        if self._scanner is None:
+            self._timer.stop()
+            self.sort(self._sort_column, self._sort_order)
+            self.directory_loaded.emit(self.path)
+
+    def set_sort_field(self, field):
+        """ Show column with value of filelist.SORT_TAGS[field]; hide
+        column when `field` is None. """
+        if field == self.sort_field:
+            return
+        column = self.FIELD_COLUMN
+        if self.sort_field is None:
+            self.beginInsertColumns(QtCore.QModelIndex(), column, column)
+            self.sort_field = field
+            self.endInsertColumns()
+            return
+        if field is None:
+            self.beginRemoveColumns(QtCore.QModelIndex(), column, column)
+            self.sort_field = None
+            self.endRemoveColumns()
+            if self._sort_column == column:
+                self._sort_column = 0
+            return
+        self.sort_field = field
+        self.headerDataChanged.emit(QtCore.Qt.Horizontal, column, column)
+        self.sort_keys_loaded(True)
+
+    def sort_keys_loaded(self, finished=False):
+        """ Show new loaded sort keys; when sorted by sort field - sort
+        rows (not often than `RESORT_INTERVAL` if not `finished`). """
+        if self.sort_field is None or not self._names:
+            return
+        self.dataChanged.emit(self.index(0, self.FIELD_COLUMN),
+                              self.index(len(self._names) - 1,
+                                         self.FIELD_COLUMN))
+        if self._sort_column != self.FIELD_COLUMN:
+            return
+        if finished:
+            self._resort_timer.stop()
+            self._resort()
+        elif not self._resort_timer.isActive():
+            self._resort_timer.start()
+
+    def _resort(self):
+        self.sort(self._sort_column, self._sort_order)
+
+    def _sort_key(self, row):
+        keys = self._filelist.get_sort_keys(
+            os.path.join(self.path, self._names[row]), False)
+        return keys[self.sort_field] if keys else None
+
+    def _stat(self, row):
+        if self._sizes[row] < 0:
+            try:
+                fstat = os.stat(os.path.join(self.path, self._names[row]))
+                self._sizes[row] = fstat.st_size
+                self._mtimes[row] = fstat.st_mtime
+            except OSError:
+                self._sizes[row] = self._mtimes[row] = 0
+
+    def filePath(self, index):
+        """ Get path of file in row `index`; None for invalid index. """
+        if not index.isValid():
+            return None
+        return os.path.join(self.path, self._names[index.row()])
+
+    def path_index(self, path):
+        """ Get index of file `path`; invalid index when file is not in
+        model. """
+        dirname, name = os.path.split(path)
+        if self.path and os.path.abspath(dirname) == \
+                os.path.abspath(self.path) and name in self._names:
+            return self.index(self._names.index(name), 0)
+        return QtCore.QModelIndex()
+
+    def refresh(self, path):
+        """ Reload file attributes and sort key of file `path` (i.e. file
+        was changed on disk). """
+        index = self.path_index(path)
+        if not index.isValid():
+            return
+        row = index.row()
+        self._sizes[row] = self._mtimes[row] = -1
+        self.dataChanged.emit(index,
+                              self.index(row, self.columnCount() - 1))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.COLUMNS) + (self.sort_field is not None)
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
-        if role == QtCore.Qt.FontRole and index.isValid():
+        if not index.isValid():
+            pass
+        elif role == QtCore.Qt.DisplayRole:
+            row, column = index.row(), index.column()
+            if column == 0:
+                return QtCore.QVariant(self._names[row])
+            if column == self.FIELD_COLUMN:
+                return QtCore.QVariant(self._sort_key(row) or "")
+            self._stat(row)
+            if column == 1:
+                return QtCore.QVariant(_format_size(self._sizes[row]))
+            return QtCore.QVariant(time.strftime(
+                "%Y-%m-%d %H:%M", time.localtime(self._mtimes[row])))
+        elif role == QtCore.Qt.TextAlignmentRole:
+            if index.column() == 1:
+                return QtCore.QVariant(QtCore.Qt.AlignRight |
+                                       QtCore.Qt.AlignVCenter)
+        elif role == QtCore.Qt.FontRole:
             # bold names for changed files
-            fname = unicode(self.filePath(index))
-            if self._filelist.is_updated(fname):
+            if self._is_updated(index.row()):
                 font = QtGui.QFont()
                 font.setBold(True)
                 return font
-        return super(MyFileSystemModel, self).data(index, role)
+        return QtCore.QVariant()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and \
+                role == QtCore.Qt.DisplayRole:
+            if section == self.FIELD_COLUMN:
+                return QtCore.QVariant(self.SORT_FIELDS[self.sort_field])
+            return QtCore.QVariant(self.COLUMNS[section])
+        return QtCore.QVariant()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """ Sort rows; when directory is still loading rows are sorted
+        again after loading all files. """
+        if column >= self.columnCount():
+            column = 0
+        self._sort_column, self._sort_order = column, order
+        if not self._names:
+            return
+        if column == 0:
+            keys = [name.lower() for name in self._names]
+        elif column == self.FIELD_COLUMN:
+            # files without value at the end; same values sorted by name
+            keys = []
+            for row, name in enumerate(self._names):
+                value = self._sort_key(row)
+                keys.append((value is None, value, name.lower()))
+        else:
+            for row in xrange(len(self._names)):
+                self._stat(row)
+            keys = self._sizes if column == 1 else self._mtimes
+        rows = sorted(xrange(len(keys)), key=keys.__getitem__,
+                      reverse=order == QtCore.Qt.DescendingOrder)
+        self._reorder(rows)
+
+    def _reorder(self, order):
+        """ Move rows; `order` is list of current row numbers in new order.
+        """
+        self.layoutAboutToBeChanged.emit()
+        self._names = [self._names[row] for row in order]
+        self._sizes = array.array('d', (self._sizes[row] for row in order))
+        self._mtimes = array.array('d', (self._mtimes[row] for row in order))
+        self._bold_rows.clear()
+        new_rows = array.array('l', order)
+        for new_row, old_row in enumerate(order):
+            new_rows[old_row] = new_row
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(new_rows[idx.row()], idx.column())
+                       for idx in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def _is_updated(self, row):
+        filelist = self._filelist
+        if not filelist.updated:
+            return False
+        if self._bold_version != filelist.dirty_version:
+            self._bold_rows.clear()
+            self._bold_version = filelist.dirty_version
+        updated = self._bold_rows.get(row)
+        if updated is None:
+            updated = self._bold_rows[row] = filelist.is_updated(
+                os.path.join(self.path, self._names[row]))
+        return updated
+
+
+def _format_size(size):
+    """ Format file size in human-readable form. """
+    for unit in ("bytes", "KiB", "MiB"):
+        if size < 1024:
+            return ("%d %s" if unit == "bytes" else "%.1f %s") % (size, unit)
+        size /= 1024.0
+    return "%.1f GiB" % size
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+""" Shared thumbnails cache (freedesktop.org Thumbnail Managing Standard).
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import logging
+import hashlib
+import urllib
+import threading
+import Queue
+import tempfile
+
+from PyQt4 import QtCore, QtGui
+
+from exifeditor.lib import profiling
+
+_LOG = logging.getLogger(__name__)
+
+# (directory, max size) sorted by size
+_FLAVORS = (('normal', 128), ('large', 256), ('x-large', 512),
+            ('xx-large', 1024))
+
+
+def _cache_dir():
+    """ Get thumbnails directory (~/.cache/thumbnails by default). """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'thumbnails')
+
+
+def file_uri(path):
+    """ Get canonical uri for `path`. """
+    path = os.path.abspath(path)
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return 'file://' + urllib.quote(path)
+
+
+class ThumbnailStore(object):
+    """ Load and store thumbnails in shared cache.
+
+    Thumbnails are written by background thread.
+
+    Args:
+        cache_dir: thumbnails directory (default: $XDG_CACHE_HOME/thumbnails)
+    """
+
+    def __init__(self, cache_dir=None):
+        self._cache_dir = cache_dir or _cache_dir()
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @profiling.timed("thumbnails.load")
+    def load(self, path, size):
+        """ Load thumbnail for `path` and scale it to `size` px.
+
+        Flavors at least `size` large are checked from the smallest; then
+        next smaller flavor is used (scaled up).
+
+        Returns:
+            QImage or None when valid thumbnail not exists.
+        """
+        try:
+            mtime = int(os.stat(path).st_mtime)
+        except OSError:
+            return None
+        uri = file_uri(path)
+        name = hashlib.md5(uri).hexdigest() + '.png'
+        larger = [flavor for flavor in _FLAVORS if flavor[1] >= size]
+        smaller = [flavor for flavor in _FLAVORS if flavor[1] < size]
+        for flavor, _fsize in larger + smaller[-1:]:
+            tpath = os.path.join(self._cache_dir, flavor, name)
+            if not os.path.isfile(tpath):
+                continue
+            image = QtGui.QImage(tpath)
+            if image.isNull():
+                continue
+            if str(image.text('Thumb::URI')) != uri or \
+                    str(image.text('Thumb::MTime')) != str(mtime):
+                _LOG.debug("ThumbnailStore.load: outdated %s", tpath)
+                continue
+            _LOG.debug("ThumbnailStore.load: %s", tpath)
+            if image.width() != size and image.height() != size:
+                image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio,
+                                     QtCore.Qt.SmoothTransformation)
+            return image
+        return None
+
+    def store(self, path, image, size):
+        """ Queue store thumbnail of `path` made from `image` (QImage) in
+        flavor fitting `size` px.
+
+        Image is scaled to flavor size before queueing, so queue don't keep
+        full size images.
+        """
+        if image.isNull():
+            return
+        flavor, fsize = _FLAVORS[-1]
+        for flavor, fsize in _FLAVORS:
+            if fsize >= size:
+                break
+        if image.width() > fsize or image.height() > fsize:
+            image = image.scaled(fsize, fsize, QtCore.Qt.KeepAspectRatio,
+                                 QtCore.Qt.SmoothTransformation)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((path, image, flavor))
+
+    def close(self):
+        """ Write remaining thumbnails and stop writer. """
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception:  # pylint: disable=W0703
+                _LOG.exception("ThumbnailStore: write %r error", item[0])
+
+    def _write(self, path, image, flavor):
+        mtime = int(os.stat(path).st_mtime)
+        uri = file_uri(path)
+        tdir = os.path.join(self._cache_dir, flavor)
+        if not os.path.isdir(tdir):
+            os.makedirs(tdir, 0700)
+        image.setText('Thumb::URI', uri)
+        image.setText('Thumb::MTime', str(mtime))
+        image.setText('Thumb::Size', str(os.path.getsize(path)))
+        image.setText('Software', 'exifeditor')
+        # write to temp file and rename - other apps may read this file
+        fdesc, tmpname = tempfile.mkstemp(suffix='.png', dir=tdir)
+        os.close(fdesc)
+        try:
+            if not image.save(tmpname, 'PNG'):
+                _LOG.warn("ThumbnailStore: can't write thumbnail for %s",
+                          path)
+                return
+            os.chmod(tmpname, 0600)
+            os.rename(tmpname, os.path.join(
+                tdir, hashlib.md5(uri).hexdigest() + '.png'))
+            _LOG.debug("ThumbnailStore: stored %s %s", flavor, path)
+        finally:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+""" Watching changes of files made by other applications.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import logging
+
+from PyQt4 import QtCore
+
+from exifeditor.logic import watcher
+
+_LOG = logging.getLogger(__name__)
+
+
+class FileWatcher(QtCore.QObject):
+    """ Invalidate files loaded by FileList when changed on disk.
+
+    By default QFileSystemWatcher (inotify) watches current directory (for
+    files replaced by rename) and up to `MAX_FILES` loaded files. When
+    `poll_interval` is given or some path can't be watched (i.e. network
+    file systems, inotify limit), files are checked periodically by
+    logic.watcher.PollingWatcher instead.
+
+    Signals:
+        files_changed(dict path -> True when file has unsaved changes)
+    """
+
+    files_changed = QtCore.pyqtSignal(object)
+    # files reported by poller; delivered to GUI thread
+    _polled = QtCore.pyqtSignal(object)
+
+    # max number of individually watched files
+    MAX_FILES = 1000
+    # delay for collecting notifications before checking files (ms)
+    CHECK_DELAY = 300
+    # interval of polling used when paths can't be watched (s)
+    FALLBACK_POLL_INTERVAL = 5
+
+    def __init__(self, filelist, poll_interval=None, parent=None):
+        super(FileWatcher, self).__init__(parent)
+        self._filelist = filelist
+        self._watcher = self._poller = None
+        self._polled.connect(self._refresh)
+        if poll_interval:
+            self._start_polling(poll_interval)
+            return
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._on_file_changed)
+        self._watcher.directoryChanged.connect(self._on_dir_changed)
+        self._watched = set()  # paths added to _watcher
+        self._changed = set()  # changed files; None = check all files
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.CHECK_DELAY)
+        self._timer.timeout.connect(self._check)
+
+    def _start_polling(self, interval):
+        self._poller = watcher.PollingWatcher(self._filelist, interval,
+                                              self._polled.emit)
+
+    def update(self, directory):
+        """ Watch `directory` and files loaded by FileList. """
+        if self._watcher is None:
+            return
+        wanted = set(self._filelist.loaded_files()[:self.MAX_FILES])
+        if directory:
+            wanted.add(directory)
+        removed = self._watched - wanted
+        if removed:
+            self._watcher.removePaths(list(removed))
+            self._watched -= removed
+        added = wanted - self._watched
+        if not added:
+            return
+        self._watcher.addPaths(list(added))
+        watched = set(unicode(path) for path in self._watcher.files())
+        watched.update(unicode(path)
+                       for path in self._watcher.directories())
+        failed = added - watched
+        self._watched |= added - failed
+        # paths removed in meantime are not errors
+        if any(os.path.exists(path) for path in failed):
+            _LOG.warn("FileWatcher: can't watch %d paths; switching to "
+                      "polling", len(failed))
+            self._switch_to_polling()
+
+    def _switch_to_polling(self):
+        """ Stop using QFileSystemWatcher and start polling. """
+        self._timer.stop()
+        self._watcher.fileChanged.disconnect(self._on_file_changed)
+        self._watcher.directoryChanged.disconnect(self._on_dir_changed)
+        self._watcher.deleteLater()
+        self._watcher = None
+        self._watched.clear()
+        self._start_polling(self.FALLBACK_POLL_INTERVAL)
+
+    def _on_file_changed(self, path):
+        path = unicode(path)
+        # removed or replaced file is no longer watched; add it again on
+        # next update
+        if path not in set(unicode(fpath) for fpath in self._watcher.files()):
+            self._watched.discard(path)
+        if self._changed is not None:
+            self._changed.add(path)
+        self._timer.start()
+
+    def _on_dir_changed(self, _path):
+        # files may be replaced by rename; check all
+        self._changed = None
+        self._timer.start()
+
+    def _check(self):
+        changed, self._changed = self._changed, set()
+        self._refresh(None if changed is None else list(changed))
+
+    def _refresh(self, paths):
+        """ Invalidate changed files from `paths` (None = all files). """
+        changes = self._filelist.refresh_changed(paths)
+        if changes:
+            _LOG.info("FileWatcher: changed files: %r", changes)
+            self.files_changed.emit(changes)
+
+    def close(self):
+        if self._poller:
+            self._poller.close()
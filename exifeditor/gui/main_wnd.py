@@ -13,14 +13,16 @@ __version__ = "2014-11-11"
 
 import logging
 import os.path
+import time
 
 from PyQt4 import QtGui, QtCore
 
+from exifeditor.gui import _loader
 from exifeditor.gui import _models
 from exifeditor.gui import resources_rc
 from exifeditor.gui import ui_main
-from exifeditor.logic import exif, filelist
-from exifeditor.lib import appconfig
+from exifeditor.logic import exif, filelist, query, templates
+from exifeditor.lib import appconfig, profiling
 
 _LOG = logging.getLogger(__name__)
 
@@ -45,76 +47,112 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
         if not current_dir or not os.path.isdir(current_dir):
             current_dir = QtCore.QDir.currentPath()
 
-        self._filelist = filelist.FileList()
+        aconf = appconfig.AppConfig()
+        self._filelist = filelist.FileList(
+            aconf.get('filelist.prefetch_workers', 2),
+            aconf.get('filelist.exif_cache_entries', 200),
+            aconf.get('filelist.pixmap_cache_size', 128) * 1024 * 1024,
+            None, aconf.get('filelist.sidecar_formats'))
+        self._prefetch_range = aconf.get('filelist.prefetch_range', 5)
+        # metadata index, thumbnails store and watcher are created by
+        # `_start_services` when event loop is started
+        self._index = self._thumbnails = self._watcher = None
+        self._loader = _loader.ImageLoader(self._filelist, None, self)
+        self._sort_loader = _loader.SortKeysLoader(
+            self._filelist, aconf.get('filelist.prefetch_workers', 2), self)
         self._current_path = current_dir
         self._current_image = None
-
-        # setup dirs tree
+        self._current_file = None
+        self._show_started = None  # for measure image show latency
+        self._last_query = ""
+
+        # setup dirs tree; show only start directory and its siblings -
+        # listing all parent directories up to filesystem root is slow
+        # (i.e. on network file systems)
+        root_dir = os.path.dirname(os.path.abspath(current_dir))
         self._tv_dirs_model = model = QtGui.QFileSystemModel(self)
-        model.setRootPath(QtCore.QDir.rootPath())
+        model.setRootPath(root_dir)
         model.setFilter(QtCore.QDir.AllDirs | QtCore.QDir.NoDotAndDotDot)
         self.tv_dirs.setModel(model)
-        self.tv_dirs.setRootIndex(model.index(QtCore.QDir.rootPath()))
+        self.tv_dirs.setRootIndex(model.index(root_dir))
         self.tv_dirs.setCurrentIndex(model.index(current_dir))
         self.tv_dirs.setColumnWidth(0, 200)
 
         # setup files list
         model = self._lv_files_model = \
-                _models.MyFileSystemModel(self._filelist, self)
-        # QtGui.QFileSystemModel(self)
-        self._create_file_list_model(current_dir)
+                _models.FileListModel(self._filelist, self)
         self.lv_files.setModel(model)
-        self.lv_files.setRootIndex(model.setRootPath(current_dir))
+        self.lv_files.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        # action -> sort field (index in filelist.SORT_TAGS)
+        self._sort_actions = {self.a_sort_name: None, self.a_sort_date: 0,
+                              self.a_sort_camera: 1, self.a_sort_lens: 2}
+        self._sort_group = QtGui.QActionGroup(self)
+        for action in self._sort_actions:
+            self._sort_group.addAction(action)
         self.lv_files.setColumnWidth(0, 200)
 
         # exif list
         self._tv_info_model = _models.ExifTreeModel()
-        model = QtGui.QSortFilterProxyModel()
+        model = self._tv_info_proxy = QtGui.QSortFilterProxyModel()
         model.setSourceModel(self._tv_info_model)
         model.setDynamicSortFilter(True)
         self.tv_info.setModel(model)
+        self.tv_info.setSelectionMode(
+            QtGui.QAbstractItemView.ExtendedSelection)
+        # fixed width of labels column; resizing to contents require
+        # creating all tag nodes and decoding their labels
+        self.tv_info.header().setResizeMode(0, QtGui.QHeaderView.Interactive)
+        self.tv_info.setColumnWidth(0, 250)
 
         self._bind()
 
         # restore size
-        aconf = appconfig.AppConfig()
         width = aconf.get('main_wnd.width', 1024)
         height = aconf.get('main_wnd.height', 700)
         self.resize(width, height)
 
+        # load files after window is shown; select file if included
+        # in arguments
+        def _on_loaded(_path):
+            model.directory_loaded.disconnect(_on_loaded)
+            idx = model.path_index(start_file)
+            if idx.isValid():
+                self.lv_files.selectionModel().setCurrentIndex(
+                    idx, QtGui.QItemSelectionModel.ClearAndSelect |
+                    QtGui.QItemSelectionModel.Rows)
+
+        model = self._lv_files_model
+        if start_file:
+            model.directory_loaded.connect(_on_loaded)
+        QtCore.QTimer.singleShot(0, self._start_services)
+        QtCore.QTimer.singleShot(0, lambda: model.set_directory(current_dir))
+
         # scroll to current dir
         def _scroll():
             idx = self._tv_dirs_model.index(current_dir)
             self.tv_dirs.scrollTo(idx, QtGui.QAbstractItemView.PositionAtTop)
             self.tv_dirs.expand(idx)
 
-            # select file if included in arguments
-            if start_file:
-                sel_model = self.lv_files.selectionModel()
-                idx = self._lv_files_model.index(start_file)
-                if idx.isValid():
-                    sel_model.select(idx,
-                                     QtGui.QItemSelectionModel.ClearAndSelect)
-                    sel_model.currentChanged.emit(idx, idx)
-
         QtCore.QTimer.singleShot(100, _scroll)
 
-    def _create_file_list_model(self, path):
-        model = self._lv_files_model
-        model.reset()
-        model.setRootPath(path)
-        model.setFilter(QtCore.QDir.Files | QtCore.QDir.NoSymLinks |
-                        QtCore.QDir.NoDotAndDotDot)
-        model.setNameFilters(["*.jpg", "*.png", "*.tiff", "*.tif", "*.nef"])
-        model.setNameFilterDisables(False)
-
     def _bind(self):
+        self._loader.exif_loaded.connect(self._on_exif_loaded)
+        self._loader.image_loaded.connect(self._on_image_loaded)
+        self._loader.load_error.connect(self._on_load_error)
         self.tv_dirs.clicked.connect(self._on_tv_dirs_activated)
         self.b_save.pressed.connect(self._on_save_pressed)
         self.tabWidget.currentChanged.connect(self._on_tab_changed)
         self.a_about.activated.connect(self._on_about)
         self.a_prev_file.activated.connect(self._on_prev_file)
         self.a_next_file.activated.connect(self._on_next_file)
+        self.a_find_files.activated.connect(self._on_find_files)
+        self.a_save_template.activated.connect(self._on_save_template)
+        self.a_apply_template.activated.connect(self._on_apply_template)
+        self.a_delete_template.activated.connect(self._on_delete_template)
+        self._sort_group.triggered.connect(self._on_sort_action)
+        self._sort_loader.keys_loaded.connect(self._on_sort_keys_loaded)
+        self._sort_loader.finished.connect(self._on_sort_keys_finished)
+        self._lv_files_model.directory_loaded.connect(self._on_files_loaded)
         # file list model
         sel_model = self.lv_files.selectionModel()
         sel_model.currentChanged.connect(self._on_lv_files_selection)
@@ -131,10 +169,32 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
         self.btn_datetime.pressed.connect(self._on_btn_datetime)
         self.btn_copyright.pressed.connect(self._on_btn_copyright)
 
+    @profiling.timed("MainWnd._start_services")
+    def _start_services(self):
+        """ Open metadata index and thumbnails store and start watching
+        files. Called after window is shown. """
+        from exifeditor.gui import _thumbnails
+        from exifeditor.gui import _watcher
+        from exifeditor.logic import metaindex
+        aconf = appconfig.AppConfig()
+        if aconf.get('filelist.metadata_index', True):
+            self._index = metaindex.MetadataIndex(
+                os.path.join(aconf.user_share_dir, 'metadata.db'))
+            self._filelist.set_index(self._index)
+        if aconf.get('thumbnails.enabled', True):
+            self._thumbnails = _thumbnails.ThumbnailStore()
+            self._loader.thumbnails = self._thumbnails
+        self._watcher = _watcher.FileWatcher(
+            self._filelist, aconf.get('filelist.watch_poll_interval'), self)
+        self._watcher.files_changed.connect(self._on_files_changed)
+        self._watcher.update(self._current_path)
+
     def _clear(self):
         """ Clear all displayed information. """
         self.tv_info.reset()
+        self._loader.cancel()
         self._current_image = None
+        self._current_file = None
         self.g_view.setPixmap(QtGui.QPixmap())
         self._tv_info_model.update(None)
         self.te_description.setPlainText("")
@@ -149,21 +209,56 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
         self.te_copyright.setEnabled(False)
         self.dt_datetime.setEnabled(False)
 
+    @profiling.timed("MainWnd._show_image")
     def _show_image(self, path):
-        """ load image from `path` and display exif informations. """
+        """ Start loading image from `path`; exif informations and preview
+        are displayed when loaded. """
+        if profiling.is_enabled():
+            self._show_started = time.time()
         self.statusBar().showMessage('Loading...')
-        self.tv_info.reset()
-        self._current_image = self._filelist.get_exif(path)  # exif.Image(path)
+        self._current_image = None
+        self._current_file = path
         pixmap = self._filelist.get_pixmap(path)
-        if pixmap is None:
-            thumb = QtGui.QImage(path)
-            thumb = thumb.scaled(self.g_view.size(), QtCore.Qt.KeepAspectRatio)
-            pixmap = QtGui.QPixmap.fromImage(thumb)
-            self._filelist.set_pixmap(path, pixmap)
-        self.g_view.setPixmap(pixmap)
+        self.g_view.setPixmap(QtGui.QPixmap() if pixmap is None else pixmap)
+        size = self.g_view.size()
+        self._loader.load(path, size.width(), size.height(), pixmap is None)
+
+    def _on_exif_loaded(self, generation, image):
+        if generation != self._loader.generation:
+            return
+        if self._tv_info_model.image is None or \
+                self._tv_info_model.image.path != image.path:
+            self.tv_info.reset()
+        self._current_image = image
+        if self._watcher:
+            self._watcher.update(self._current_path)
         self._update_tab_basic()
         self._update_tab_exif()
+        if self._filelist.get_pixmap(image.path) is not None:
+            self.statusBar().clearMessage()
+            self._image_shown()
+
+    def _on_image_loaded(self, generation, path, thumb):
+        if generation != self._loader.generation:
+            return
+        pixmap = QtGui.QPixmap.fromImage(thumb)
+        self._filelist.set_pixmap(path, pixmap)
+        self.g_view.setPixmap(pixmap)
         self.statusBar().clearMessage()
+        self._image_shown()
+
+    def _image_shown(self):
+        """ Register time from request to show image. """
+        if self._show_started is not None:
+            profiling.add("MainWnd.show_image_latency",
+                          time.time() - self._show_started)
+            self._show_started = None
+
+    def _on_load_error(self, generation, path, error):
+        if generation != self._loader.generation:
+            return
+        self._clear()
+        self.statusBar().showMessage('Error loading %s: %s' % (path, error))
 
     def _update_tab_basic(self):
         """ Show basic informations ("Basic" tab) """
@@ -196,10 +291,12 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
 
     def _update_tab_exif(self):
         """ Show detailed exif data. """
-        self._tv_info_model.update(self._current_image)
-        self.tv_info.expandAll()
-        self.tv_info.resizeColumnToContents(0)
-        self.tv_info.resizeColumnToContents(1)
+        if self._tv_info_model.update(self._current_image):
+            # expand only first group; tags of other groups are loaded by
+            # model when group is expanded
+            index = self._tv_info_proxy.index(0, 0)
+            if index.isValid():
+                self.tv_info.expand(index)
 
     def closeEvent(self, event):
         reply = QtGui.QMessageBox.question(self, 'Exit',
@@ -213,6 +310,15 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
         size = self.size()
         aconf['main_wnd.width'] = size.width()
         aconf['main_wnd.height'] = size.height()
+        self._loader.close()
+        self._sort_loader.close()
+        if self._watcher:
+            self._watcher.close()
+        self._filelist.close()
+        if self._index:
+            self._index.close()
+        if self._thumbnails:
+            self._thumbnails.close()
         event.accept()
 
     def _on_tv_dirs_activated(self, index):
@@ -231,10 +337,11 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
             if reply == QtGui.QMessageBox.Yes:
                 self._save()
         self._current_path = unicode(node)
+        self._sort_loader.cancel()
         self._filelist.reset()
-        # force create new model due some caching problems
-        self._create_file_list_model(node)
-        self.lv_files.setRootIndex(self._lv_files_model.setRootPath(node))
+        self._lv_files_model.set_directory(self._current_path)
+        if self._watcher:
+            self._watcher.update(self._current_path)
         self._clear()
 
     def _on_lv_files_selection(self, index):
@@ -243,12 +350,27 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
                    self._current_path)
         if not self._current_path:
             return
-        item = self._lv_files_model.fileInfo(index).absoluteFilePath()
+        item = self._lv_files_model.filePath(index)
         if item:
-            self._show_image(unicode(item))
+            self._show_image(item)
+            self._prefetch_around(index)
             return
         self._clear()
 
+    def _prefetch_around(self, index):
+        """ Load in background exif for files around `index`. """
+        model = self._lv_files_model
+        parent = index.parent()
+        row = index.row()
+        rows = range(max(row - self._prefetch_range, 0),
+                     min(row + self._prefetch_range + 1,
+                         model.rowCount(parent)))
+        # nearest files first
+        rows.sort(key=lambda x: abs(x - row))
+        files = [model.filePath(model.index(frow, 0, parent))
+                 for frow in rows if frow != row]
+        self._filelist.prefetch(files)
+
     def _on_save_pressed(self):
         """ Save changed metadata. """
         num_updated = self._filelist.updated
@@ -287,10 +409,13 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
                  str(value.toString('yyyy:MM:dd HH:mm:ss'))
 
     def _on_tab_changed(self, idx):
+        if not self._current_image:
+            return
         if idx == 0:
             self._update_tab_basic()
-#        elif idx == 1:
-#           self._update_tab_exif()
+        elif idx == 1:
+            # refresh only changed tags
+            self._update_tab_exif()
 
     def _on_about(self):
         from exifeditor import version
@@ -325,33 +450,238 @@ class MainWnd(QtGui.QMainWindow, ui_main.Ui_MainWindow):
             row = selected[0].row()
             self.lv_files.selectRow(row + 1)
 
+    def _on_find_files(self):
+        """ Select files matching query. """
+        text, res = QtGui.QInputDialog.getText(
+            self, "Find files", "Query (i.e. Exif.Photo.ISOSpeedRatings > "
+            "3200 and not Exif.Image.Copyright):", text=self._last_query)
+        if not res or not unicode(text).strip():
+            return
+        self._last_query = text = unicode(text)
+        model = self._lv_files_model
+        root = self.lv_files.rootIndex()
+        indexes = {}
+        for row in xrange(model.rowCount(root)):
+            index = model.index(row, 0, root)
+            indexes[model.filePath(index)] = index
+        self.statusBar().showMessage('Searching...')
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            found = self._filelist.query(text, indexes.keys())
+        except query.QueryError, err:
+            QtGui.QMessageBox.critical(self, "Find files",
+                                       "Invalid query: %s" % err)
+            return
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        selection = QtGui.QItemSelection()
+        for fname in found:
+            selection.select(indexes[fname], indexes[fname])
+        self.lv_files.selectionModel().select(
+            selection, QtGui.QItemSelectionModel.ClearAndSelect |
+            QtGui.QItemSelectionModel.Rows)
+        self.statusBar().showMessage('Found %d files' % len(found), 2000)
+
+    def _on_sort_action(self, action):
+        """ Sort files by name or selected exif field. """
+        field = self._sort_actions[action]
+        model = self._lv_files_model
+        model.set_sort_field(field)
+        if field is None:
+            self._sort_loader.cancel()
+            self.lv_files.sortByColumn(0, QtCore.Qt.AscendingOrder)
+            return
+        self.lv_files.sortByColumn(model.FIELD_COLUMN,
+                                   QtCore.Qt.AscendingOrder)
+        self._load_sort_keys()
+
+    def _load_sort_keys(self):
+        """ Start loading not cached sort keys for listed files. """
+        model = self._lv_files_model
+        if model.sort_field is None:
+            return
+        paths = [model.filePath(model.index(row, 0))
+                 for row in xrange(model.rowCount())]
+        paths = [path for path in paths
+                 if self._filelist.get_sort_keys(path, False) is None]
+        if paths:
+            self.statusBar().showMessage('Reading metadata...')
+            self._sort_loader.load(paths)
+
+    def _on_files_loaded(self, path):
+        if self._index:
+            self._index.prune(path)
+        self._load_sort_keys()
+
+    def _on_sort_keys_loaded(self, generation, _keys):
+        if generation == self._sort_loader.generation:
+            self._lv_files_model.sort_keys_loaded()
+
+    def _on_sort_keys_finished(self, generation):
+        if generation == self._sort_loader.generation:
+            self._lv_files_model.sort_keys_loaded(True)
+            self.statusBar().clearMessage()
+
     def _copy_to_selected(self, tag):
         sel_model = self.lv_files.selectionModel()
         selected = sel_model.selectedRows()
-        if len(selected) < 2:
+        if len(selected) < 2 or not self._current_image:
             return
         src_filename = self._current_image.path
-        sel_files = (unicode(self._lv_files_model.filePath(idx))
+        sel_files = (self._lv_files_model.filePath(idx)
                      for idx in selected)
         dst_files = [fname for fname in sel_files if fname != src_filename]
-        self._filelist.copy_exif_tag(src_filename, dst_files, (tag, ))
+        errors = self._filelist.copy_exif_tag(src_filename, dst_files,
+                                              (tag, ))
         for idx in selected:
             self._lv_files_model.dataChanged.emit(idx, idx)
+        if errors:
+            self._show_errors("Copying tags error!", errors)
+
+    def _on_save_template(self):
+        """ Save tags selected in exif tab as template. """
+        if not self._current_image:
+            return
+        tags = set()
+        for index in self.tv_info.selectionModel().selectedRows():
+            node = self._tv_info_model.node_from_index(
+                self._tv_info_proxy.mapToSource(index))
+            if isinstance(node, _models.ExifValueTreeNode):
+                tags.add(node.key)
+        if not tags:
+            QtGui.QMessageBox.information(
+                self, "Save template", "Please select tags in Exif tab.")
+            return
+        name, res = QtGui.QInputDialog.getText(self, "Save template",
+                                               "Template name:")
+        name = unicode(name).strip()
+        if not res or not name:
+            return
+        template = templates.Template.from_image(name, self._current_image,
+                                                 tags)
+        templates.save_template(appconfig.AppConfig(), template)
+        self.statusBar().showMessage('Template %s saved' % name, 2000)
+
+    def _on_apply_template(self):
+        """ Apply template to selected files. """
+        aconf = appconfig.AppConfig()
+        tmpls = templates.load_templates(aconf)
+        if not tmpls:
+            QtGui.QMessageBox.information(self, "Apply template",
+                                          "No templates defined.")
+            return
+        selected = self.lv_files.selectionModel().selectedRows()
+        if not selected:
+            return
+        name, res = QtGui.QInputDialog.getItem(
+            self, "Apply template", "Template:", sorted(tmpls), 0, False)
+        if not res:
+            return
+        files = [self._lv_files_model.filePath(idx)
+                 for idx in selected]
+        dlg, progress = self._create_progress("Applying template...",
+                                              len(files))
+        errors = self._filelist.apply_template(
+            tmpls[unicode(name)], files,
+            aconf.get('filelist.save_workers', 4), progress)
+        dlg.reset()
+        for idx in selected:
+            self._lv_files_model.dataChanged.emit(idx, idx)
+        if errors:
+            self._show_errors("Applying template error!", errors)
+        if self._current_file in files:
+            self._show_image(self._current_file)
+
+    def _on_delete_template(self):
+        """ Delete selected template. """
+        aconf = appconfig.AppConfig()
+        tmpls = templates.load_templates(aconf)
+        if not tmpls:
+            QtGui.QMessageBox.information(self, "Delete template",
+                                          "No templates defined.")
+            return
+        name, res = QtGui.QInputDialog.getItem(
+            self, "Delete template", "Template:", sorted(tmpls), 0, False)
+        if not res:
+            return
+        name = unicode(name)
+        templates.delete_template(aconf, name)
+        self.statusBar().showMessage('Template %s deleted' % name, 2000)
+
+    def _create_progress(self, label, total):
+        """ Create progress dialog.
+
+        Returns:
+            (dialog, progress callback for FileList methods)
+        """
+        dlg = QtGui.QProgressDialog(label, "Cancel", 0, total, self)
+        dlg.setWindowModality(QtCore.Qt.WindowModal)
+        dlg.setMinimumDuration(500)
+
+        def progress(num, total):
+            dlg.setValue(num)
+            self.statusBar().showMessage('%s %d/%d' % (label, num, total))
+            QtGui.QApplication.processEvents()
+            return not dlg.wasCanceled()
+
+        return dlg, progress
+
+    def _show_errors(self, title, errors):
+        """ Show dialog with `errors` (dict path -> message). """
+        msg = "<p><b>Errors: <b></p>" + \
+                ''.join('<p>%s: %s</p>' % item
+                        for item in sorted(errors.iteritems()))
+        QtGui.QMessageBox.critical(self, title, msg, QtGui.QMessageBox.Ok)
 
     def _save(self):
         """ Save changes. """
         self.statusBar().showMessage('Saving...')
-        errors = self._filelist.save()
+        dlg, progress = self._create_progress("Saving files...",
+                                              self._filelist.updated)
+        aconf = appconfig.AppConfig()
+        errors = self._filelist.save(aconf.get('filelist.save_workers', 4),
+                                     progress)
+        dlg.reset()
         if errors:
-            msg = "<p><b>Errors: <b></p>" + \
-                    ''.join('<p>%s</p>' % err for err in errors.itervalues())
-            QtGui.QMessageBox.critical(self, "Saving files error!", msg,
-                                       QtGui.QMessageBox.Ok)
+            self._show_errors("Saving files error!", errors)
             self.statusBar().showMessage('Error during saving %d files' %
                                          len(errors), 2000)
+        elif self._filelist.updated:
+            self.statusBar().showMessage('Saving cancelled; %d files not '
+                                         'saved' % self._filelist.updated,
+                                         2000)
         else:
-            self.statusBar().showMessage('Saved', 2000)
-        self._show_image(self._current_image.path)
+            strategies = self._filelist.save_strategies.values()
+            self.statusBar().showMessage(
+                'Saved %d files (%d in place, %d in sidecars)' % (
+                    len(strategies), strategies.count(exif.SAVE_INPLACE),
+                    strategies.count(exif.SAVE_SIDECAR)),
+                2000)
+        # files may be replaced by new ones
+        if self._watcher:
+            self._watcher.update(self._current_path)
+        if self._current_file:
+            self._show_image(self._current_file)
+
+    def _on_files_changed(self, changes):
+        """ Files were changed by other application; cached data are
+        already invalidated - show new data. """
+        for path in changes:
+            self._lv_files_model.refresh(path)
+        self._load_sort_keys()
+        if self._watcher:
+            self._watcher.update(self._current_path)
+        if self._current_file in changes:
+            self._show_image(self._current_file)
+        modified = sorted(path for path, updated in changes.iteritems()
+                          if updated)
+        if modified:
+            msg = "<p>Files with unsaved changes were modified by other " \
+                "application:</p>" + \
+                ''.join('<p>%s</p>' % path for path in modified) + \
+                "<p>Changes will be applied to new version of files.</p>"
+            QtGui.QMessageBox.warning(self, "Files changed", msg,
+                                      QtGui.QMessageBox.Ok)
 
 
 #  backup
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+""" Least-recently-used cache.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+import logging
+import threading
+from collections import OrderedDict
+
+_LOG = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """ Thread-safe dict-like cache with limited number of entries and/or
+    total size.
+
+    Args:
+        max_entries: maximal number of entries (None = unlimited)
+        max_size: maximal sum of entries size (None = unlimited)
+        sizeof: function returning size of value (default: 1)
+        pinned: function returning True for values that can't be evicted
+    """
+
+    def __init__(self, max_entries=None, max_size=None, sizeof=None,
+                 pinned=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._sizeof = sizeof or (lambda _value: 1)
+        self._pinned = pinned or (lambda _value: False)
+        self._lock = threading.RLock()
+        self._data = OrderedDict()  # key -> (value, size)
+        self._size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value[0]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._remove(key)
+            size = self._sizeof(value)
+            self._data[key] = (value, size)
+            self._size += size
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if not self._remove(key):
+                raise KeyError(key)
+
+    @property
+    def size(self):
+        """ Total size of cached values. """
+        return self._size
+
+    def get(self, key, default=None):
+        """ Get value for `key` and mark it as recently used. """
+        with self._lock:
+            if key in self._data:
+                return self[key]
+            return default
+
+    def setdefault(self, key, value):
+        """ Get value for `key`; when not exists - store `value`. """
+        with self._lock:
+            if key in self._data:
+                return self[key]
+            self[key] = value
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._remove(key)
+            return item[0]
+
+    def values(self):
+        """ List of cached values (from least recently used). """
+        with self._lock:
+            return [value for value, _size in self._data.itervalues()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is None:
+            return False
+        self._size -= item[1]
+        return True
+
+    def _over_limit(self):
+        return ((self.max_entries is not None and
+                 len(self._data) > self.max_entries) or
+                (self.max_size is not None and self._size > self.max_size))
+
+    def _evict(self):
+        """ Remove least recently used, not pinned entries until cache fit
+        in limits. """
+        if not self._over_limit():
+            return
+        # never remove last added entry
+        for key, (value, _size) in self._data.items()[:-1]:
+            if not self._over_limit():
+                break
+            if not self._pinned(value):
+                _LOG.debug("LRUCache._evict: %r", key)
+                self._remove(key)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+""" Simple timing of operations.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+import time
+import logging
+import functools
+import threading
+
+_LOG = logging.getLogger(__name__)
+
+_ENABLED = False
+_TIMINGS = {}  # operation name -> list of durations
+_LOCK = threading.Lock()
+
+
+def enable():
+    """ Enable collecting timings. """
+    global _ENABLED  # pylint: disable=W0603
+    _ENABLED = True
+
+
+def is_enabled():
+    return _ENABLED
+
+
+def add(name, duration):
+    """ Register `duration` of operation `name`. """
+    with _LOCK:
+        _TIMINGS.setdefault(name, []).append(duration)
+
+
+def timed(name):
+    """ Decorator - measure time of function call when profiling is
+    enabled. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+class timer(object):  # pylint: disable=C0103
+    """ Context manager - measure time of block when profiling is enabled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._start = None
+
+    def __enter__(self):
+        if _ENABLED:
+            self._start = time.time()
+        return self
+
+    def __exit__(self, *_args):
+        if self._start is not None:
+            add(self.name, time.time() - self._start)
+        return False
+
+
+def _percentile(values, perc):
+    return values[min(int(len(values) * perc / 100.0), len(values) - 1)]
+
+
+def summary():
+    """ Get timings summary.
+
+    Returns:
+        list of (name, count, total, p50, p95, max) sorted by total time
+    """
+    with _LOCK:
+        items = [(name, sorted(values)) for name, values
+                 in _TIMINGS.iteritems() if values]
+    result = [(name, len(values), sum(values), _percentile(values, 50),
+               _percentile(values, 95), values[-1])
+              for name, values in items]
+    result.sort(key=lambda x: -x[2])
+    return result
+
+
+def log_summary():
+    """ Write timings summary to log. """
+    lines = ["%-32s %7s %10s %10s %10s %10s" % ("operation", "count",
+                                                "total [s]", "p50 [ms]",
+                                                "p95 [ms]", "max [ms]")]
+    for name, count, total, p50, p95, tmax in summary():
+        lines.append("%-32s %7d %10.3f %10.2f %10.2f %10.2f" % (
+            name, count, total, p50 * 1000, p95 * 1000, tmax * 1000))
+    _LOG.info("Profiling summary:\n%s", "\n".join(lines))
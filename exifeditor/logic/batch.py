@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+""" Batch (command line) operations on many files.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+
+This module must not depend on PyQt.
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import sys
+import glob
+import fnmatch
+import logging
+import itertools
+from multiprocessing.pool import ThreadPool
+
+from exifeditor.logic import exif
+from exifeditor.logic import query as mquery
+from exifeditor.logic import templates
+from exifeditor.lib import appconfig
+from exifeditor.logic.filelist import IMAGE_PATTERNS
+
+_LOG = logging.getLogger(__name__)
+
+USAGE = """Batch commands:
+  help                       show this message
+  set TAG VALUE PATH...      set TAG to VALUE
+  delete TAG PATH...         delete TAG
+  copy SRC TAG[,TAG] PATH... copy tags from file SRC
+  template NAME PATH...      apply template NAME
+  query QUERY PATH...        print files matching QUERY, i.e.:
+      'Exif.Photo.ISOSpeedRatings > 3200 and not Exif.Image.Copyright'
+PATH may be file, directory or glob pattern."""
+
+
+class BatchError(Exception):
+    pass
+
+
+def iter_files(paths, patterns=IMAGE_PATTERNS, recursive=False):
+    """ Find image files.
+
+    Args:
+        paths: list of files, directories or glob patterns
+        patterns: file name patterns used for files in directories
+        recursive: search files in subdirectories
+
+    Returns:
+        iter of file paths
+    """
+    def match(fname):
+        fname = fname.lower()
+        return any(fnmatch.fnmatch(fname, pattern) for pattern in patterns)
+
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        elif os.path.isdir(path):
+            if recursive:
+                for dirpath, _dirs, files in os.walk(path):
+                    for fname in files:
+                        if match(fname):
+                            yield os.path.join(dirpath, fname)
+            else:
+                for fname in sorted(os.listdir(path)):
+                    fpath = os.path.join(path, fname)
+                    if match(fname) and os.path.isfile(fpath):
+                        yield fpath
+        else:
+            matched = False
+            for fpath in glob.iglob(path):
+                matched = True
+                if os.path.isfile(fpath):
+                    yield fpath
+            if not matched:
+                _LOG.warn("iter_files: %s not found", path)
+
+
+def process_files(files, operation, workers=4, dry_run=False,
+                  chunk_size=64):
+    """ Apply `operation` to each file and save changes.
+
+    Files are processed in chunks so memory usage not depend on number of
+    files.
+
+    Args:
+        files: iter of file paths
+        operation: function(exif.Image) that change image
+        workers: number of threads
+        dry_run: don't save changes
+        chunk_size: number of files processed in one chunk by each worker
+
+    Returns:
+        iter of (path, updated, save strategy or None, error message or None)
+    """
+    def process(path):
+        try:
+            image = exif.Image(path)
+            operation(image)
+            updated = image.updated
+            strategy = None
+            if updated and not dry_run:
+                strategy = image.save()
+            return path, updated, strategy, None
+        except Exception, err:  # pylint: disable=W0703
+            _LOG.debug("process_files: %s error", path, exc_info=True)
+            return path, False, None, str(err)
+
+    pool = ThreadPool(workers)
+    try:
+        files = iter(files)
+        while True:
+            chunk = list(itertools.islice(files, chunk_size * workers))
+            if not chunk:
+                break
+            for result in pool.imap_unordered(process, chunk):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def query_files(files, query, workers=4, chunk_size=64):
+    """ Find files matching `query` (query.Query).
+
+    Returns:
+        iter of (path, matched, error message or None)
+    """
+    def process(path):
+        try:
+            return path, query.match(exif.Image(path)), None
+        except Exception, err:  # pylint: disable=W0703
+            _LOG.debug("query_files: %s error", path, exc_info=True)
+            return path, False, str(err)
+
+    pool = ThreadPool(workers)
+    try:
+        files = iter(files)
+        while True:
+            chunk = list(itertools.islice(files, chunk_size * workers))
+            if not chunk:
+                break
+            for result in pool.imap(process, chunk):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_query(args, recursive, workers):
+    if len(args) < 2:
+        raise BatchError("usage: query QUERY PATH...")
+    try:
+        query = mquery.Query(_decode(args[0]))
+    except mquery.QueryError, err:
+        raise BatchError("invalid query: %s" % err)
+    errors = 0
+    for path, matched, error in query_files(
+            iter_files(args[1:], recursive=recursive), query, workers):
+        if error:
+            errors += 1
+            print >> sys.stderr, "%s: %s" % (path, error)
+        elif matched:
+            print path
+    return 1 if errors else 0
+
+
+def _set_tag_op(tag, value):
+    def operation(image):
+        image.set_value(tag, value)
+    return operation
+
+
+def _delete_tag_op(tag):
+    def operation(image):
+        image.del_value(tag)
+    return operation
+
+
+def _copy_tags_op(src, tags):
+    try:
+        src_exif = exif.Image(src)
+    except Exception, err:  # pylint: disable=W0703
+        raise BatchError("can't read %s: %s" % (src, err))
+    # decode source values once
+    template = templates.Template.from_image(None, src_exif, tags)
+    src_path = os.path.abspath(src)
+
+    def operation(image):
+        if os.path.abspath(image.path) != src_path:
+            template.apply(image)
+    return operation
+
+
+def _decode(value):
+    if isinstance(value, str):
+        return value.decode(sys.getfilesystemencoding() or 'utf-8')
+    return value
+
+
+def parse_command(args):
+    """ Parse batch command arguments.
+
+    Returns:
+        (operation, paths)
+    """
+    if not args:
+        raise BatchError("missing command")
+    command, args = args[0], args[1:]
+    if command == 'set':
+        if len(args) < 3:
+            raise BatchError("usage: set TAG VALUE PATH...")
+        return _set_tag_op(args[0], _decode(args[1])), args[2:]
+    if command == 'delete':
+        if len(args) < 2:
+            raise BatchError("usage: delete TAG PATH...")
+        return _delete_tag_op(args[0]), args[1:]
+    if command == 'copy':
+        if len(args) < 3:
+            raise BatchError("usage: copy SRC TAG[,TAG] PATH...")
+        return _copy_tags_op(args[0], args[1].split(',')), args[2:]
+    if command == 'template':
+        if len(args) < 2:
+            raise BatchError("usage: template NAME PATH...")
+        tmpls = templates.load_templates(appconfig.AppConfig())
+        template = tmpls.get(_decode(args[0]))
+        if template is None:
+            raise BatchError("unknown template: %s; available: %s" %
+                             (args[0], ", ".join(sorted(tmpls))))
+        return template.apply, args[1:]
+    raise BatchError("unknown command: %s" % command)
+
+
+def run(args, recursive=False, workers=4, dry_run=False):
+    """ Run batch command.
+
+    Returns:
+        exit code
+    """
+    if args and args[0] == 'help':
+        print USAGE
+        return 0
+    try:
+        if args and args[0] == 'query':
+            return _run_query(args[1:], recursive, workers)
+        operation, paths = parse_command(args)
+    except BatchError, err:
+        print >> sys.stderr, "Error:", err
+        print >> sys.stderr, USAGE
+        return 2
+    processed = updated = inplace = sidecar = errors = 0
+    for path, fupdated, strategy, error in process_files(
+            iter_files(paths, recursive=recursive), operation, workers,
+            dry_run):
+        processed += 1
+        if error:
+            errors += 1
+            print >> sys.stderr, "%s: %s" % (path, error)
+        elif fupdated:
+            updated += 1
+            inplace += strategy == exif.SAVE_INPLACE
+            sidecar += strategy == exif.SAVE_SIDECAR
+            _LOG.info("updated %s (%s)", path, strategy or "not saved")
+    print "Processed: %d, updated: %d (in place: %d, sidecar: %d), " \
+        "errors: %d" % (processed, updated, inplace, sidecar, errors)
+    return 1 if errors else 0
@@ -12,12 +12,40 @@ __copyright__ = u"Copyright (c) Karol Będkowski, 2014"
 __version__ = "2014-11-09"
 
 
+import os
+import bisect
 import logging
 
-from gi.repository import GExiv2
+from exifeditor.lib import profiling
+from exifeditor.logic import fastexif
+from exifeditor.logic import inplace
 
 _LOG = logging.getLogger(__name__)
 
+# save strategies returned by Image.save
+SAVE_INPLACE = 'in place'
+SAVE_REWRITE = 'rewrite'
+SAVE_SIDECAR = 'sidecar'
+
+# extensions of formats which changes are saved by default in XMP sidecar
+# files instead of rewriting (large, proprietary) image file
+SIDECAR_FORMATS = frozenset(('.nef', '.nrw', '.cr2', '.crw', '.arw', '.sr2',
+                             '.srf', '.orf', '.rw2', '.pef', '.raf', '.srw'))
+
+# content of new, empty sidecar file
+_EMPTY_XMP = (
+    '<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+    '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+    ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"/>\n'
+    '</x:xmpmeta>\n'
+    '<?xpacket end="w"?>\n')
+
+_XMP_ARRAY_TYPES = ('XmpSeq', 'XmpBag')
+
+# GExiv2 module; imported by `_metadata` on first use - loading typelib
+# through gi is slow and not needed before first file is opened.
+_GEXIV2 = None
+
 _EXIF_GROUP_SORTING = {
     'Exif.Image': -100,
     'Exif.Photo': -80,
@@ -27,6 +55,222 @@ _EXIF_GROUP_SORTING = {
 }
 
 
+def _metadata(path):
+    """ Create GExiv2.Metadata for file `path`. """
+    global _GEXIV2  # pylint: disable=W0603
+    if _GEXIV2 is None:
+        with profiling.timer("import GExiv2"):
+            from gi.repository import GExiv2
+        _GEXIV2 = GExiv2
+    return _GEXIV2.Metadata(path)
+
+
+def read_tags(path, tags, metadata=None):
+    """ Read values of `tags` without creating Image.
+
+    Args:
+        path: image file path
+        tags: list of tag names
+        metadata: optional GExiv2.Metadata or CachedMetadata; when not given
+            metadata is read from file.
+
+    Returns:
+        list of values (unicode or None)
+    """
+    if metadata is None:
+        metadata = _metadata(path)
+    values = []
+    for tag in tags:
+        value = metadata.get(tag)
+        if value is not None:
+            value = value.decode('utf-8', errors='replace').strip(u'\0 ')
+        values.append(value or None)
+    return values
+
+
+def sidecar_path(path, existing=False):
+    """ Get path of XMP sidecar file for image `path`.
+
+    Both `image.nef.xmp` and `image.xmp` are recognized; new sidecars are
+    created with first name.
+
+    Args:
+        path: image file path
+        existing: return None when sidecar file not exists
+    """
+    candidates = (path + '.xmp', os.path.splitext(path)[0] + '.xmp')
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None if existing else candidates[0]
+
+
+def _encode_comment(value):
+    """ Encode `value` for Exif.Photo.UserComment. """
+    try:
+        return 'ASCII ' + str(value)
+    except UnicodeError:
+        return 'Unicode ' + value
+
+
+def _comment_to_xmp(value):
+    for prefix in ('ASCII ', 'Unicode '):
+        if value.startswith(prefix):
+            return value[len(prefix):]
+    return value
+
+
+def _date_to_xmp(value):
+    """ Convert exif date (YYYY:MM:DD HH:MM:SS) to xmp format. """
+    date, _sep, dtime = value.partition(' ')
+    return date.replace(':', '-') + ('T' + dtime if dtime else '')
+
+
+def _date_from_xmp(value):
+    """ Convert xmp date to exif format; None for incomplete dates. """
+    if len(value) < 19:
+        return None
+    return value[:10].replace('-', ':') + ' ' + value[11:19]
+
+
+def _no_conversion(value):
+    return value
+
+
+# exif tag -> (xmp tag, conversion to xmp, conversion from xmp);
+# values of these tags in sidecar override values from image file
+_SIDECAR_TAGS = {
+    'Exif.Image.ImageDescription': ('Xmp.dc.description', _no_conversion,
+                                    _no_conversion),
+    'Exif.Image.Artist': ('Xmp.dc.creator', _no_conversion, _no_conversion),
+    'Exif.Image.Copyright': ('Xmp.dc.rights', _no_conversion,
+                             _no_conversion),
+    'Exif.Image.DateTime': ('Xmp.xmp.ModifyDate', _date_to_xmp,
+                            _date_from_xmp),
+    'Exif.Photo.DateTimeOriginal': ('Xmp.exif.DateTimeOriginal',
+                                    _date_to_xmp, _date_from_xmp),
+    'Exif.Photo.UserComment': ('Xmp.exif.UserComment', _comment_to_xmp,
+                               _encode_comment),
+}
+
+# prefixes of exif tags converted to xmp without changing values
+_SIDECAR_GROUPS = {
+    'Exif.Image.': 'Xmp.tiff.',
+    'Exif.Photo.': 'Xmp.exif.',
+}
+
+
+def _sidecar_tag(tag):
+    """ Get (xmp tag, value conversion) used for storing `tag` in sidecar.
+
+    Raises:
+        ExifSaveError when tag can't be stored in sidecar
+    """
+    if tag in _SIDECAR_TAGS:
+        return _SIDECAR_TAGS[tag][:2]
+    if tag.startswith('Xmp.'):
+        return tag, _no_conversion
+    for prefix, xmp_prefix in _SIDECAR_GROUPS.iteritems():
+        if tag.startswith(prefix):
+            return xmp_prefix + tag[len(prefix):], _no_conversion
+    raise ExifSaveError("Tag %s can't be saved in sidecar" % tag)
+
+
+def _exif_tag(xmp_tag):
+    """ Get (exif tag, value conversion) for xmp tag stored in sidecar;
+    (None, None) for tags without exif equivalent. """
+    for tag, (stored_tag, _conv, conv) in _SIDECAR_TAGS.iteritems():
+        if stored_tag == xmp_tag:
+            return tag, conv
+    for prefix, xmp_prefix in _SIDECAR_GROUPS.iteritems():
+        if xmp_tag.startswith(xmp_prefix):
+            name = xmp_tag[len(xmp_prefix):]
+            # skip GPS tags (different format) and structures
+            if name.startswith('GPS') or '/' in name or '[' in name:
+                break
+            return prefix + name, _no_conversion
+    return None, None
+
+
+def _xmp_text(metadata, tag, separator='; '):
+    """ Get value of xmp `tag` as plain text. """
+    tag_type = metadata.get_tag_type(tag)
+    if tag_type in _XMP_ARRAY_TYPES:
+        return separator.join(metadata.get_tag_multiple(tag))
+    value = metadata[tag]
+    if tag_type == 'LangAlt' and value.startswith('lang="'):
+        value = value.split(' ', 1)[1]
+    return value
+
+
+def _merge_sidecar(metadata, sidecar):
+    """ Copy xmp tags from `sidecar` to `metadata` (both GExiv2.Metadata).
+
+    Values of exif tags with xmp equivalents are also updated; empty xmp
+    value mark exif tag deleted in sidecar.
+    """
+    for tag in sidecar.get_xmp_tags():
+        exif_tag, conv = _exif_tag(tag)
+        value = None
+        if exif_tag is not None:
+            value = _xmp_text(sidecar, tag,
+                              '; ' if exif_tag in _SIDECAR_TAGS else ' ')
+        if tag in metadata:
+            del metadata[tag]
+        if value is not None and not value.strip():
+            # tag deleted in sidecar
+            if exif_tag in metadata:
+                del metadata[exif_tag]
+            continue
+        if sidecar.get_tag_type(tag) in _XMP_ARRAY_TYPES:
+            metadata.set_tag_multiple(tag, sidecar.get_tag_multiple(tag))
+        else:
+            metadata[tag] = sidecar[tag]
+        if value is not None:
+            value = conv(value)
+            if value:
+                metadata[exif_tag] = value
+
+
+def read_metadata(path, sidecar=False):
+    """ Read metadata of image `path`.
+
+    Args:
+        path: image file path
+        sidecar: merge data from existing xmp sidecar file
+
+    Returns:
+        GExiv2.Metadata
+    """
+    metadata = _metadata(path)
+    if sidecar:
+        spath = sidecar_path(path, True)
+        if spath:
+            _LOG.debug("read_metadata: merge %s", spath)
+            _merge_sidecar(metadata, _metadata(spath))
+    return metadata
+
+
+def _same_value(raw, value):
+    """ Check is `value` equal raw value of tag. """
+    if isinstance(value, unicode):
+        raw = raw.decode('utf-8', errors='replace')
+    return raw == value
+
+
+def _group_sort_key(group):
+    return (_EXIF_GROUP_SORTING.get(group, 0), group)
+
+
+def _tag_group(tag):
+    return tag.rsplit('.', 1)[0]
+
+
+# tag types that don't require interpretation
+_TEXT_TAG_TYPES = ('Ascii', 'XmpSeq', 'XmpText', 'XmpBag', 'String',
+                   'LangAlt')
+
+
 class ExifUpdateError(Exception):
     pass
 
@@ -35,27 +279,171 @@ class ExifSaveError(Exception):
 
 
 class Image(object):
-    """Image file representation. """
-    def __init__(self, path):
+    """Image file representation.
+
+    Args:
+        path: image file path
+        metadata: optional read-only metadata (i.e. loaded from index);
+            real metadata is loaded from file before first change.
+        on_change: optional function called with image as argument when
+            `updated` flag changes.
+        sidecar: save changes in XMP sidecar file and merge data from
+            existing sidecar; default: for files in SIDECAR_FORMATS.
+    """
+    @profiling.timed("Image.__init__")
+    def __init__(self, path, metadata=None, on_change=None, sidecar=None):
         self.path = path
-        self.exif = GExiv2.Metadata(path)
-        self.groups = None
+        if sidecar is None:
+            sidecar = os.path.splitext(path)[1].lower() in SIDECAR_FORMATS
+        self.sidecar = sidecar
+        self.exif = metadata if metadata is not None \
+            else read_metadata(path, sidecar)
+        self.cached = metadata is not None
+        self.groups = None  # sorted groups names
+        self._group_keys = None  # sort keys for `groups`
+        self._tags_by_group = None  # group -> sorted tags
         self._create_groups()
-        self.updated = False
+        self._updated = False
+        self.on_change = on_change
+        # changes since last save: tag -> new value or None when deleted;
+        # FileList keeps reference to this dict for updated image (as
+        # pending changes), so it is only modified in place - `save`
+        # replace it with new dict when changes are written.
+        self.edits = {}
+
+    def _get_updated(self):
+        return self._updated
+
+    def _set_updated(self, value):
+        value = bool(value)
+        if value != self._updated:
+            self._updated = value
+            if self.on_change:
+                self.on_change(self)
+
+    """ Image has unsaved changes """
+    updated = property(_get_updated, _set_updated)
+
+    def _load(self):
+        """ Load metadata from file when image use cached data. """
+        if self.cached:
+            _LOG.debug("Image._load %s", self.path)
+            self.exif = read_metadata(self.path, self.sidecar)
+            self.cached = False
+        return self.exif
+
+    def _check_sidecar_tag(self, tag):
+        """ Check that change of `tag` can be saved in sidecar.
+
+        Raises:
+            ExifUpdateError when tag has no xmp equivalent
+        """
+        if self.sidecar:
+            try:
+                _sidecar_tag(tag)
+            except ExifSaveError, err:
+                raise ExifUpdateError(str(err))
 
+    def _write(self, tag, value):
+        """ Set `tag` in metadata and record change in `edits`.
+
+        Returns:
+            False when tag already has given value (nothing changed)
+        """
+        self._check_sidecar_tag(tag)
+        self._load()
+        current = self.exif.get(tag)
+        if current is not None and _same_value(current, value):
+            return False
+        self.exif[tag] = value
+        self.edits[tag] = value
+        return True
+
+    def _delete(self, tag):
+        """ Delete `tag` from metadata and record change in `edits`. """
+        self._check_sidecar_tag(tag)
+        self._load()
+        del self.exif[tag]
+        self.edits[tag] = None
+
+    def apply_edits(self, edits):
+        """ Repeat changes recorded in `edits` of other Image object for
+        the same file (i.e. released before save). """
+        for tag, value in edits.iteritems():
+            if value is None:
+                if tag in self.exif:
+                    self._delete(tag)
+                    self._remove_tag(tag)
+            else:
+                exists = tag in self.exif
+                self._write(tag, value)
+                if not exists:
+                    self._add_tag(tag)
+        if edits:
+            self.updated = True
+
+    @profiling.timed("Image.save")
     def save(self):
-        """ Save changes """
+        """ Save changes.
+
+        Changes of images using sidecar are saved in XMP sidecar file.
+        Metadata in JPEG files is updated in place when new metadata fit in
+        space of old; otherwise whole file is rewritten.
+
+        Returns:
+            used strategy: SAVE_SIDECAR, SAVE_INPLACE or SAVE_REWRITE
+        """
         _LOG.info("Image.save %s", self.path)
         try:
-            res = self.exif.save_file()
-            _LOG.info("Image.save done: res=%r", res)
+            if self.sidecar:
+                self._save_sidecar()
+                strategy = SAVE_SIDECAR
+            elif inplace.save_jpeg(self.exif, self.path):
+                strategy = SAVE_INPLACE
+            else:
+                res = self.exif.save_file()
+                _LOG.debug("Image.save: save_file res=%r", res)
+                strategy = SAVE_REWRITE
+            _LOG.info("Image.save done: %s", strategy)
         except Exception, err:
             _LOG.exception("Exif.save(%s) error", self.path)
             raise ExifSaveError(err)
-            return False
         else:
+            self.edits = {}
             self.updated = False
-        return True
+        return strategy
+
+    def _save_sidecar(self):
+        """ Write `edits` to sidecar file; create it when not exists.
+
+        Deleted exif tags are stored as empty xmp values (they can't be
+        removed from image file).
+        """
+        changes = []  # (xmp tag, new value or None)
+        for tag, value in self.edits.iteritems():
+            xmp_tag, conv = _sidecar_tag(tag)
+            if value is not None:
+                value = conv(value)
+            elif not tag.startswith('Xmp.'):
+                value = ''
+            changes.append((xmp_tag, value))
+        path = sidecar_path(self.path)
+        created = not os.path.exists(path)
+        if created:
+            with open(path, 'wb') as ofile:
+                ofile.write(_EMPTY_XMP)
+        try:
+            sidecar = _metadata(path)
+            for xmp_tag, value in changes:
+                if xmp_tag in sidecar:
+                    del sidecar[xmp_tag]
+                if value is not None:
+                    sidecar[xmp_tag] = value
+            sidecar.save_file()
+        except Exception:
+            if created:
+                os.remove(path)
+            raise
 
     def get_value(self, tag):
         """ Get value for given tag.
@@ -91,10 +479,14 @@ class Image(object):
             TODO: better way to detect changes
         """
         # _LOG.debug("Exif.set_value(%s, %s, %r)", self.path, tag, value)
+        self._load()
         old_value = self.exif.get(tag)
-        self.exif[tag] = value
+        if not self._write(tag, value):
+            return self.updated
         if tag not in self.exif:
             raise ExifUpdateError("Error updating tag %s" % tag)
+        if old_value is None:
+            self._add_tag(tag)
         new_value = self.exif[tag]  # because of interpretation
         self.updated |= old_value != new_value
         return self.updated
@@ -102,15 +494,78 @@ class Image(object):
     def del_value(self, tag):
         """ Delete tag from exif. """
         if tag in self.exif:
-            del self.exif[tag]
+            self._delete(tag)
+            self._remove_tag(tag)
             self.updated = True
         return self.updated
 
+    def get_tags(self):
+        """ Get all tags ordered by groups """
+        for group in self.groups:
+            for tag in self._tags_by_group[group]:
+                yield tag
+
     def get_tags_by_group(self, group):
-        """ Get tags in given `group` """
-        for key in self.exif.get_tags():
-            if key.startswith(group):
-                yield key
+        """ Get sorted list of tags in given `group` """
+        return self._tags_by_group.get(group, [])
+
+    def get_raw_tags(self):
+        """ Get all tags with values.
+
+        Returns:
+            iter of (tag, tag type, raw value, interpreted value or None)
+        """
+        for tag in self.exif.get_tags():
+            tag_type = self.exif.get_tag_type(tag)
+            interp = None
+            if tag_type not in _TEXT_TAG_TYPES:
+                interp = self.exif.get_tag_interpreted_string(tag)
+            yield tag, tag_type, self.exif.get(tag), interp
+
+    def get_preview(self, width, height):
+        """ Get smallest embedded preview image that fill `width` x `height`
+        area (in both dimensions).
+
+        JPEG previews embedded in EXIF are read directly from file by
+        fastexif; other previews are read by GExiv2. Cached metadata is not
+        replaced; previews are read from temporary metadata object.
+
+        Returns:
+            (mime type, image data) or None when no such preview found.
+        """
+        preview = self._get_fast_preview(width, height)
+        if preview is not None:
+            return preview
+        metadata = _metadata(self.path) if self.cached else self.exif
+        previews = [prop for prop in metadata.get_preview_properties() or []
+                    if prop.get_width() >= width and
+                    prop.get_height() >= height]
+        if not previews:
+            return None
+        prop = min(previews, key=lambda x: x.get_width() * x.get_height())
+        _LOG.debug("Image.get_preview(%s): %dx%d %s", self.path,
+                   prop.get_width(), prop.get_height(), prop.get_mime_type())
+        preview = metadata.get_preview_image(prop)
+        return prop.get_mime_type(), preview.get_data()
+
+    def _get_fast_preview(self, width, height):
+        """ Find smallest JPEG preview that fill `width` x `height` by
+        fastexif. """
+        try:
+            with fastexif.Metadata(self.path) as metadata:
+                previews = [prev for prev in metadata.get_previews()
+                            if prev[0] >= width and prev[1] >= height]
+                if not previews:
+                    return None
+                pwidth, pheight, offset, length = min(
+                    previews, key=lambda x: x[0] * x[1])
+                _LOG.debug("Image.get_preview(%s): %dx%d fastexif",
+                           self.path, pwidth, pheight)
+                return 'image/jpeg', metadata.read(offset, length)
+        except (fastexif.FormatError, EnvironmentError), err:
+            _LOG.debug("Image.get_preview(%s): fastexif error: %s",
+                       self.path, err)
+        return None
 
     def get_tag_label(self, tag):
         """ Get human friendly tag name. """
@@ -132,13 +587,45 @@ class Image(object):
             yield group, group.replace('.', ' ')
 
     def _create_groups(self):
-        """ Find groups of tags """
-        groups = {}
+        """ Build index of tags by groups """
+        tags_by_group = {}
         for tag in self.exif.get_tags():
-            prefix = tag.rsplit('.', 1)[0]
-            groups[prefix] = None
-        self.groups = sorted(groups.iterkeys(),
-                             key=lambda x: (_EXIF_GROUP_SORTING.get(x, 0), x))
+            tags_by_group.setdefault(_tag_group(tag), []).append(tag)
+        for tags in tags_by_group.itervalues():
+            tags.sort()
+        self._tags_by_group = tags_by_group
+        self.groups = sorted(tags_by_group.iterkeys(), key=_group_sort_key)
+        self._group_keys = map(_group_sort_key, self.groups)
+
+    def _add_tag(self, tag):
+        """ Add new `tag` to groups index """
+        group = _tag_group(tag)
+        tags = self._tags_by_group.get(group)
+        if tags is None:
+            self._tags_by_group[group] = [tag]
+            key = _group_sort_key(group)
+            pos = bisect.bisect(self._group_keys, key)
+            self._group_keys.insert(pos, key)
+            self.groups.insert(pos, group)
+            return
+        pos = bisect.bisect_left(tags, tag)
+        if pos == len(tags) or tags[pos] != tag:
+            tags.insert(pos, tag)
+
+    def _remove_tag(self, tag):
+        """ Remove `tag` from groups index """
+        group = _tag_group(tag)
+        tags = self._tags_by_group.get(group)
+        if not tags:
+            return
+        pos = bisect.bisect_left(tags, tag)
+        if pos < len(tags) and tags[pos] == tag:
+            del tags[pos]
+        if not tags:
+            del self._tags_by_group[group]
+            pos = self.groups.index(group)
+            del self.groups[pos]
+            del self._group_keys[pos]
 
     def debug_tag(self, tag):
         """ Get given tag informations (for debugging. """
@@ -185,11 +672,8 @@ class Image(object):
     def _set_comment(self, value):
         if value == self._get_comment():
             return
-        try:
-            strvalue = str(value)
-            self.exif[self.COMMENT_TAG] = 'ASCII ' + strvalue
-        except UnicodeError:
-            self.exif[self.COMMENT_TAG] = 'Unicode ' + value
+        self._write(self.COMMENT_TAG, _encode_comment(value))
+        self._add_tag(self.COMMENT_TAG)
         self.updated = True
 
     """  Exif.Photo.UserComment property """
@@ -205,7 +689,8 @@ class Image(object):
 
     def _set_artist(self, value):
         if self._get_artist() != value:
-            self.exif[self.ARTIST_TAG] = value
+            self._write(self.ARTIST_TAG, value)
+            self._add_tag(self.ARTIST_TAG)
             self.updated = True
 
     """  Exif.Image.Artist property. """
@@ -219,7 +704,8 @@ class Image(object):
 
     def _set_copyright(self, value):
         if value != self._get_copyright():
-            self.exif[self.COPYRIGHT_TAG] = value
+            self._write(self.COPYRIGHT_TAG, value)
+            self._add_tag(self.COPYRIGHT_TAG)
             self.updated = True
 
     """  Exif.Image.Copyright property. """
@@ -233,7 +719,8 @@ class Image(object):
 
     def _set_datetime(self, value):
         if value != self._get_datetime():
-            self.exif[self.DATETIME_TAG] = value
+            self._write(self.DATETIME_TAG, value)
+            self._add_tag(self.DATETIME_TAG)
             self.updated = True
 
     """  Exif.Image.DateTime property. """
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+""" Fast read-only access to EXIF tags.
+
+File is memory-mapped and only JPEG APP1 / TIFF IFD structures are parsed;
+values are decoded when requested. Supported are Exif.Image, Exif.Photo
+and Exif.GPSInfo tags; values are formatted like raw values returned by
+GExiv2 (without interpretation).
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import mmap
+import struct
+import logging
+
+_LOG = logging.getLogger(__name__)
+
+
+class FormatError(Exception):
+    """ Unsupported file format or invalid metadata structure. """
+    pass
+
+
+# tiff type -> (exiv2 type name, item size)
+_TYPES = {
+    1: ('Byte', 1),
+    2: ('Ascii', 1),
+    3: ('Short', 2),
+    4: ('Long', 4),
+    5: ('Rational', 8),
+    6: ('SByte', 1),
+    7: ('Undefined', 1),
+    8: ('SShort', 2),
+    9: ('SLong', 4),
+    10: ('SRational', 8),
+    11: ('Float', 4),
+    12: ('Double', 8),
+    13: ('Ifd', 4),
+}
+
+# tiff type -> struct format of numeric values (rationals as pairs)
+_FORMATS = {3: 'H', 4: 'I', 5: 'I', 6: 'b', 8: 'h', 9: 'i', 10: 'i',
+            11: 'f', 12: 'd', 13: 'I'}
+
+# UserComment character code -> exiv2 charset name
+_CHARSETS = {
+    'ASCII\0\0\0': 'Ascii',
+    'JIS\0\0\0\0\0': 'Jis',
+    'UNICODE\0': 'Unicode',
+}
+
+_EXIF_IFD_TAG = 'Exif.Image.ExifTag'
+_GPS_IFD_TAG = 'Exif.Image.GPSTag'
+_SUB_IFDS_TAG = 'Exif.Image.SubIFDs'
+
+# JPEGInterchangeFormat, JPEGInterchangeFormatLength
+_JPEG_OFFSET_TAG = 0x0201
+_JPEG_LENGTH_TAG = 0x0202
+# JPEG start of frame markers (without DHT, JPG and DAC)
+_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - frozenset((0xc4, 0xc8, 0xcc))
+
+# group -> tag id -> name (as in exiv2)
+_TAG_NAMES = {
+    'Exif.Image': {
+        0x00fe: 'NewSubfileType',
+        0x0100: 'ImageWidth',
+        0x0101: 'ImageLength',
+        0x0102: 'BitsPerSample',
+        0x0103: 'Compression',
+        0x0106: 'PhotometricInterpretation',
+        0x010e: 'ImageDescription',
+        0x010f: 'Make',
+        0x0110: 'Model',
+        0x0111: 'StripOffsets',
+        0x0112: 'Orientation',
+        0x0115: 'SamplesPerPixel',
+        0x0116: 'RowsPerStrip',
+        0x0117: 'StripByteCounts',
+        0x011a: 'XResolution',
+        0x011b: 'YResolution',
+        0x011c: 'PlanarConfiguration',
+        0x0128: 'ResolutionUnit',
+        0x0131: 'Software',
+        0x0132: 'DateTime',
+        0x013b: 'Artist',
+        0x013c: 'HostComputer',
+        0x013e: 'WhitePoint',
+        0x013f: 'PrimaryChromaticities',
+        0x014a: 'SubIFDs',
+        0x0201: 'JPEGInterchangeFormat',
+        0x0202: 'JPEGInterchangeFormatLength',
+        0x0211: 'YCbCrCoefficients',
+        0x0213: 'YCbCrPositioning',
+        0x0214: 'ReferenceBlackWhite',
+        0x02bc: 'XMLPacket',
+        0x4746: 'Rating',
+        0x4749: 'RatingPercent',
+        0x8298: 'Copyright',
+        0x83bb: 'IPTCNAA',
+        0x8769: 'ExifTag',
+        0x8773: 'InterColorProfile',
+        0x8825: 'GPSTag',
+    },
+    'Exif.Photo': {
+        0x829a: 'ExposureTime',
+        0x829d: 'FNumber',
+        0x8822: 'ExposureProgram',
+        0x8827: 'ISOSpeedRatings',
+        0x8830: 'SensitivityType',
+        0x8832: 'RecommendedExposureIndex',
+        0x9000: 'ExifVersion',
+        0x9003: 'DateTimeOriginal',
+        0x9004: 'DateTimeDigitized',
+        0x9101: 'ComponentsConfiguration',
+        0x9102: 'CompressedBitsPerPixel',
+        0x9201: 'ShutterSpeedValue',
+        0x9202: 'ApertureValue',
+        0x9203: 'BrightnessValue',
+        0x9204: 'ExposureBiasValue',
+        0x9205: 'MaxApertureValue',
+        0x9206: 'SubjectDistance',
+        0x9207: 'MeteringMode',
+        0x9208: 'LightSource',
+        0x9209: 'Flash',
+        0x920a: 'FocalLength',
+        0x927c: 'MakerNote',
+        0x9286: 'UserComment',
+        0x9290: 'SubSecTime',
+        0x9291: 'SubSecTimeOriginal',
+        0x9292: 'SubSecTimeDigitized',
+        0xa000: 'FlashpixVersion',
+        0xa001: 'ColorSpace',
+        0xa002: 'PixelXDimension',
+        0xa003: 'PixelYDimension',
+        0xa005: 'InteroperabilityTag',
+        0xa20e: 'FocalPlaneXResolution',
+        0xa20f: 'FocalPlaneYResolution',
+        0xa210: 'FocalPlaneResolutionUnit',
+        0xa217: 'SensingMethod',
+        0xa300: 'FileSource',
+        0xa301: 'SceneType',
+        0xa401: 'CustomRendered',
+        0xa402: 'ExposureMode',
+        0xa403: 'WhiteBalance',
+        0xa404: 'DigitalZoomRatio',
+        0xa405: 'FocalLengthIn35mmFilm',
+        0xa406: 'SceneCaptureType',
+        0xa407: 'GainControl',
+        0xa408: 'Contrast',
+        0xa409: 'Saturation',
+        0xa40a: 'Sharpness',
+        0xa40c: 'SubjectDistanceRange',
+        0xa420: 'ImageUniqueID',
+        0xa430: 'CameraOwnerName',
+        0xa431: 'BodySerialNumber',
+        0xa432: 'LensSpecification',
+        0xa433: 'LensMake',
+        0xa434: 'LensModel',
+        0xa435: 'LensSerialNumber',
+    },
+    'Exif.GPSInfo': {
+        0x0000: 'GPSVersionID',
+        0x0001: 'GPSLatitudeRef',
+        0x0002: 'GPSLatitude',
+        0x0003: 'GPSLongitudeRef',
+        0x0004: 'GPSLongitude',
+        0x0005: 'GPSAltitudeRef',
+        0x0006: 'GPSAltitude',
+        0x0007: 'GPSTimeStamp',
+        0x0008: 'GPSSatellites',
+        0x0009: 'GPSStatus',
+        0x000a: 'GPSMeasureMode',
+        0x000b: 'GPSDOP',
+        0x000c: 'GPSSpeedRef',
+        0x000d: 'GPSSpeed',
+        0x000e: 'GPSTrackRef',
+        0x000f: 'GPSTrack',
+        0x0010: 'GPSImgDirectionRef',
+        0x0011: 'GPSImgDirection',
+        0x0012: 'GPSMapDatum',
+        0x0017: 'GPSDestBearingRef',
+        0x0018: 'GPSDestBearing',
+        0x001b: 'GPSProcessingMethod',
+        0x001d: 'GPSDateStamp',
+        0x001e: 'GPSDifferential',
+    },
+}
+
+
+class Metadata(object):
+    """ Read-only EXIF metadata of JPEG or TIFF-based (i.e. NEF) file.
+
+    Implement subset of GExiv2.Metadata interface (like
+    metaindex.CachedMetadata) and `get_value` like exif.Image; values are
+    not interpreted.
+
+    Args:
+        path: image file path
+
+    Raises:
+        FormatError: unsupported file or invalid EXIF structure
+        IOError: file can't be read
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}  # tag name -> (tiff type, count, data offset)
+        self._endian = '<'
+        self._tiff = 0  # offset of tiff header
+        self._ifds = []  # offsets of IFD0 and IFD1 (thumbnail)
+        with open(path, 'rb') as ifile:
+            try:
+                self._map = mmap.mmap(ifile.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError), err:
+                raise FormatError("can't map file: %s" % err)
+        try:
+            self._parse()
+        except struct.error, err:
+            self.close()
+            raise FormatError("invalid structure: %s" % err)
+        except FormatError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+        return False
+
+    def close(self):
+        """ Unmap file; values can't be read after close. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __contains__(self, tag):
+        return tag in self._entries
+
+    def __getitem__(self, tag):
+        return self._format(tag, self._entries[tag])
+
+    def get(self, tag, default=None):
+        entry = self._entries.get(tag)
+        return default if entry is None else self._format(tag, entry)
+
+    def get_tags(self):
+        return self._entries.keys()
+
+    def get_tag_type(self, tag):
+        return _TYPES[self._entries[tag][0]][0]
+
+    def get_tag_interpreted_string(self, tag):
+        """ Values are not interpreted; return raw value. """
+        return self[tag]
+
+    def get_value(self, tag):
+        """ Get value for given tag.
+
+        Args:
+            tag: tag name
+
+        Returns:
+            (raw value, interpreted value) or None when tag not exists
+        """
+        val = self.get(tag)
+        if val is None:
+            return None
+        val = val.decode('utf-8', errors='replace')
+        return val, val
+
+    def get_previews(self):
+        """ Find embedded JPEG previews: thumbnail (IFD1) and previews
+        stored in IFD0 and SubIFDs (i.e. in NEF files).
+
+        Returns:
+            list of (width, height, offset, length); data can be read by
+            `read`
+        """
+        offsets = list(self._ifds)
+        entry = self._entries.get(_SUB_IFDS_TAG)
+        if entry is not None and entry[0] in (4, 13):
+            offsets.extend(self._unpack('%dI' % entry[1], entry[2]))
+        previews = []
+        for offset in offsets:
+            try:
+                preview = self._ifd_jpeg(offset)
+            except struct.error:
+                preview = None
+            if preview:
+                previews.append(preview)
+        return previews
+
+    def read(self, offset, length):
+        """ Read `length` bytes of file from `offset`. """
+        return self._map[offset:offset + length]
+
+    def _ifd_jpeg(self, offset):
+        """ Find JPEG image referenced by IFD at `offset`.
+
+        Returns:
+            (width, height, offset, length) or None
+        """
+        start = self._tiff + offset
+        count = self._unpack('H', start)[0]
+        if start + 2 + count * 12 > len(self._map):
+            return None
+        values = {}
+        for idx in xrange(count):
+            entry = start + 2 + idx * 12
+            tag_id, ftype = self._unpack('HH', entry)
+            if tag_id in (_JPEG_OFFSET_TAG, _JPEG_LENGTH_TAG) and \
+                    ftype in (3, 4):
+                values[tag_id] = self._unpack('H' if ftype == 3 else 'I',
+                                              entry + 8)[0]
+        if len(values) < 2:
+            return None
+        jpeg = self._tiff + values[_JPEG_OFFSET_TAG]
+        length = values[_JPEG_LENGTH_TAG]
+        if jpeg + length > len(self._map):
+            return None
+        size = self._jpeg_size(jpeg, length)
+        if size is None:
+            return None
+        return size[0], size[1], jpeg, length
+
+    def _jpeg_size(self, offset, length):
+        """ Get (width, height) of JPEG image from its SOF segment. """
+        data = self._map
+        if data[offset:offset + 2] != '\xff\xd8':
+            return None
+        end = offset + length
+        pos = offset + 2
+        while pos + 9 <= end:
+            if data[pos] != '\xff':
+                return None
+            marker = ord(data[pos + 1])
+            if marker == 0xff:  # fill byte
+                pos += 1
+                continue
+            if marker in _SOF_MARKERS:
+                height, width = struct.unpack_from('>HH', data, pos + 5)
+                return width, height
+            if marker in (0xd9, 0xda):  # EOI, SOS
+                return None
+            if marker == 0x01 or 0xd0 <= marker <= 0xd7:  # no length
+                pos += 2
+                continue
+            pos += 2 + struct.unpack_from('>H', data, pos + 2)[0]
+        return None
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self._endian + fmt, self._map, offset)
+
+    def _parse(self):
+        data = self._map
+        if data[:2] == '\xff\xd8':
+            tiff = self._find_app1()
+            if tiff is None:
+                return
+        elif data[:4] in ('II*\0', 'MM\0*'):
+            tiff = 0
+        else:
+            raise FormatError("unsupported file format")
+        order = data[tiff:tiff + 2]
+        if order not in ('II', 'MM'):
+            raise FormatError("invalid tiff header")
+        self._endian = '<' if order == 'II' else '>'
+        self._tiff = tiff
+        ifd0 = self._unpack('I', tiff + 4)[0]
+        ifd1 = self._read_ifd('Exif.Image', ifd0)
+        self._ifds = [ifd0, ifd1] if ifd1 else [ifd0]
+        for pointer, group in ((_EXIF_IFD_TAG, 'Exif.Photo'),
+                               (_GPS_IFD_TAG, 'Exif.GPSInfo')):
+            entry = self._entries.get(pointer)
+            if entry is not None and entry[0] in (4, 13):
+                self._read_ifd(group, self._unpack('I', entry[2])[0])
+
+    def _find_app1(self):
+        """ Find offset of tiff header in JPEG APP1 Exif segment. """
+        data = self._map
+        size = len(data)
+        pos = 2
+        while pos + 4 <= size:
+            if data[pos] != '\xff':
+                raise FormatError("invalid JPEG marker at %d" % pos)
+            marker = ord(data[pos + 1])
+            if marker == 0xff:  # fill byte
+                pos += 1
+                continue
+            if marker in (0xd9, 0xda):  # EOI, SOS - no more metadata
+                return None
+            if marker == 0x01 or 0xd0 <= marker <= 0xd7:  # no length
+                pos += 2
+                continue
+            if marker == 0xe1 and data[pos + 4:pos + 10] == 'Exif\0\0':
+                return pos + 10
+            pos += 2 + struct.unpack_from('>H', data, pos + 2)[0]
+        return None
+
+    def _read_ifd(self, group, offset):
+        """ Register entries of IFD at `offset` as `group` tags.
+
+        Returns:
+            offset of next IFD (0 = last IFD)
+        """
+        names = _TAG_NAMES[group]
+        size = len(self._map)
+        start = self._tiff + offset
+        count = self._unpack('H', start)[0]
+        if start + 2 + count * 12 > size:
+            raise FormatError("invalid IFD at %d" % start)
+        for idx in xrange(count):
+            entry = start + 2 + idx * 12
+            tag_id, ftype, vcount = self._unpack('HHI', entry)
+            tinfo = _TYPES.get(ftype)
+            if tinfo is None:
+                continue
+            vsize = tinfo[1] * vcount
+            voffset = entry + 8
+            if vsize > 4:
+                voffset = self._tiff + self._unpack('I', voffset)[0]
+            if voffset + vsize > size:
+                _LOG.debug("fastexif: %s 0x%04x out of file", group, tag_id)
+                continue
+            name = names.get(tag_id) or '0x%04x' % tag_id
+            self._entries[group + '.' + name] = (ftype, vcount, voffset)
+        next_ifd = start + 2 + count * 12
+        return self._unpack('I', next_ifd)[0] if next_ifd + 4 <= size else 0
+
+    def _format(self, tag, entry):
+        """ Format value like exiv2. """
+        ftype, count, offset = entry
+        data = self._map
+        if ftype == 2:  # Ascii
+            return data[offset:offset + count].split('\0', 1)[0]
+        if ftype == 7 and tag == 'Exif.Photo.UserComment':
+            return self._format_comment(data[offset:offset + count])
+        if ftype in (1, 7):  # Byte, Undefined
+            return ' '.join(str(ord(char))
+                            for char in data[offset:offset + count])
+        if ftype in (5, 10):  # rationals
+            values = self._unpack('%d%s' % (count * 2, _FORMATS[ftype]),
+                                  offset)
+            return ' '.join('%d/%d' % values[idx:idx + 2]
+                            for idx in xrange(0, len(values), 2))
+        values = self._unpack('%d%s' % (count, _FORMATS[ftype]), offset)
+        if ftype in (11, 12):
+            return ' '.join('%g' % value for value in values)
+        return ' '.join(str(value) for value in values)
+
+    def _format_comment(self, value):
+        charset = _CHARSETS.get(value[:8])
+        text = value[8:]
+        if charset == 'Unicode':
+            text = text.decode('utf-16-le' if self._endian == '<'
+                               else 'utf-16-be', 'replace').encode('utf-8')
+        text = text.rstrip('\0')
+        if charset:
+            return 'charset="%s" %s' % (charset, text)
+        return text
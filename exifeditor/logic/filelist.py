@@ -12,59 +12,535 @@ __copyright__ = u"Copyright (c) Karol Będkowski, 2014"
 __version__ = "2014-12-26"
 
 
+import os
+import stat
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 _LOG = logging.getLogger(__name__)
 
 from exifeditor.logic import exif
+from exifeditor.logic import fastexif
+from exifeditor.logic import query as mquery
+from exifeditor.logic import templates
+from exifeditor.lib.lrucache import LRUCache
+
+# supported files
+IMAGE_PATTERNS = ("*.jpg", "*.png", "*.tiff", "*.tif", "*.nef")
+# tags used for sorting files
+SORT_TAGS = ('Exif.Photo.DateTimeOriginal', 'Exif.Image.Model',
+             'Exif.Photo.LensModel')
+# lowercase extensions of supported files
+IMAGE_EXTENSIONS = frozenset(os.path.splitext(pattern)[1]
+                             for pattern in IMAGE_PATTERNS)
+
+
+def scan_images(path):
+    """ Find supported image files in directory `path`.
+
+    Files are returned in directory order; symlinks and non-regular files
+    are skipped. When scandir is available file types are taken from
+    directory entries; otherwise only files with matching extension are
+    checked by lstat.
+
+    Returns:
+        iter of file names
+    """
+    if _scandir is not None:
+        for entry in _scandir(path):
+            if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS \
+                    and not entry.is_symlink() and entry.is_file():
+                yield entry.name
+        return
+    for name in os.listdir(path):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            try:
+                mode = os.lstat(os.path.join(path, name)).st_mode
+            except OSError:
+                continue
+            if stat.S_ISREG(mode):
+                yield name
+
+
+def _read_tags(filename, tags):
+    """ Read `tags` from file; use fastexif when file is supported. """
+    try:
+        with fastexif.Metadata(filename) as metadata:
+            return exif.read_tags(filename, tags, metadata)
+    except fastexif.FormatError, err:
+        _LOG.debug("_read_tags: fastexif %r: %s", filename, err)
+    return exif.read_tags(filename, tags)
+
+
+def _file_stamp(filename):
+    """ Get (size, modification time) of file; None when file not exists.
+    """
+    try:
+        fstat = os.stat(filename)
+    except OSError:
+        return None
+    return fstat.st_size, fstat.st_mtime
+
+
+def _pixmap_size(pixmap):
+    """ Estimate memory used by `pixmap` (in bytes). """
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
 
 
 class FileList(object):
-    def __init__(self):
+    """ Loaded files.
+
+    Changes of updated images are kept as `exif.Image.edits` so images
+    can be evicted from cache before save; they are repeated when image is
+    loaded again.
+
+    Args:
+        workers: number of threads used for prefetching
+        exif_cache_entries: max number of exif objects in cache
+        pixmap_cache_size: max size of cached pixmaps in bytes
+        index: optional metaindex.MetadataIndex used for reading metadata
+        sidecar_formats: extensions of files which changes are saved in XMP
+            sidecars (default: exif.SIDECAR_FORMATS)
+    """
+    def __init__(self, workers=2, exif_cache_entries=200,
+                 pixmap_cache_size=128 * 1024 * 1024, index=None,
+                 sidecar_formats=None):
+        self._lock = threading.RLock()
+        self._index = index
+        if sidecar_formats is None:
+            sidecar_formats = exif.SIDECAR_FORMATS
+        self._sidecar_formats = frozenset(ext.lower()
+                                          for ext in sidecar_formats)
+        self._dirty_version = 0
+        self._workers = workers
+        self._pool = None
+        self._exif = LRUCache(max_entries=exif_cache_entries)
+        self._images = LRUCache(max_size=pixmap_cache_size,
+                                sizeof=_pixmap_size)
+        # path -> save strategy (exif.SAVE_*) for files saved by last `save`
+        self.save_strategies = {}
         self.reset()
 
+    def set_index(self, index):
+        """ Set metaindex.MetadataIndex used for reading metadata; index may
+        be opened after creating FileList. """
+        with self._lock:
+            self._index = index
+
     @property
     def updated(self):
         """ Number of unsaved, changed files """
-        return sum(1 for fexif in self._exif.itervalues() if fexif.updated)
+        return len(self._dirty)
+
+    @property
+    def dirty_version(self):
+        """ Counter incremented on each change of set of updated files. """
+        return self._dirty_version
+
+    def iter_updated(self):
+        """ Iterate over names of unsaved, changed files. """
+        with self._lock:
+            return iter(list(self._dirty))
 
     def reset(self):
-        self._exif = {}  # filename -> exif object
-        # cache for images
-        self._images = {}  # filename -> pixmap
+        with self._lock:
+            self._exif.clear()  # filename -> exif object
+            # cache for images
+            self._images.clear()  # filename -> pixmap
+            # prefetch state; queued jobs for files not in `_wanted` or
+            # started before reset are skipped by workers
+            self._wanted = set()
+            self._prefetching = {}  # filename -> AsyncResult
+            self._query_index = mquery.QueryIndex()
+            self._dirty = set()  # names of updated files
+            self._pending = {}  # filename -> edits of updated image
+            # filename -> (size, mtime) of file when loaded or saved
+            self._stamps = {}
+            self._dirty_version += 1
+            self._sort_keys = {}  # filename -> values of SORT_TAGS
+
+    def close(self):
+        """ Cancel pending prefetch jobs and stop workers. """
+        self.reset()
+        if self._pool:
+            self._pool.terminate()
+            self._pool = None
 
     def get_exif(self, filename):
-        fexif = self._exif.get(filename)
-        if not fexif:
-            fexif = self._exif[filename] = exif.Image(filename)
+        with self._lock:
+            fexif = self._exif.get(filename)
+            if fexif:
+                return fexif
+            job = self._prefetching.get(filename)
+        if job:
+            # file is loaded right now by worker - wait for it
+            job.wait()
+            with self._lock:
+                fexif = self._exif.get(filename)
+                if fexif:
+                    return fexif
+        fexif = self._load_exif(filename)
+        with self._lock:
+            return self._exif.setdefault(filename, fexif)
+
+    def prefetch(self, filenames):
+        """ Load exif for `filenames` in background.
+
+        Queued jobs for files not included in `filenames` are cancelled.
+        """
+        with self._lock:
+            self._wanted = set(filenames)
+            if self._pool is None:
+                self._pool = ThreadPool(self._workers)
+            for filename in filenames:
+                if filename in self._exif or filename in self._prefetching:
+                    continue
+                self._prefetching[filename] = self._pool.apply_async(
+                    self._prefetch_file, (filename, self._prefetching))
+
+    def _prefetch_file(self, filename, prefetching):
+        """ Load exif for `filename` (called by workers). """
+        try:
+            with self._lock:
+                if prefetching is not self._prefetching or \
+                        filename not in self._wanted or \
+                        filename in self._exif:
+                    return
+            try:
+                fexif = self._load_exif(filename)
+            except Exception:  # pylint: disable=W0703
+                _LOG.debug("FileList._prefetch_file(%r) error", filename,
+                           exc_info=True)
+                return
+            with self._lock:
+                # store result only when list was not reset in meantime
+                if prefetching is self._prefetching:
+                    self._exif.setdefault(filename, fexif)
+        finally:
+            with self._lock:
+                prefetching.pop(filename, None)
+
+    def _use_sidecar(self, filename):
+        """ Should changes of `filename` be saved in sidecar. """
+        return os.path.splitext(filename)[1].lower() in self._sidecar_formats
+
+    def _stamp(self, filename):
+        """ Get state of file (and its sidecar) used to detect changes. """
+        stamp = _file_stamp(filename)
+        if self._use_sidecar(filename):
+            return stamp, _file_stamp(exif.sidecar_path(filename))
+        return stamp
+
+    def _load_exif(self, filename):
+        """ Create exif.Image for `filename`; use index when available.
+        Pending changes are applied to image. """
+        stamp = self._stamp(filename)
+        sidecar = self._use_sidecar(filename)
+        # index don't track changes of sidecars
+        use_index = self._index is not None and \
+            not (sidecar and exif.sidecar_path(filename, True))
+        metadata = None
+        if use_index:
+            metadata = self._index.get(filename)
+        if metadata is not None:
+            fexif = exif.Image(filename, metadata, self._on_image_change,
+                               sidecar)
+        else:
+            fexif = exif.Image(filename, on_change=self._on_image_change,
+                               sidecar=sidecar)
+            if use_index:
+                self._index.put(fexif)
+        with self._lock:
+            self._stamps[filename] = stamp
+        edits = self._pending.get(filename)
+        if edits:
+            fexif.apply_edits(edits)
         return fexif
 
+    def _on_image_change(self, fexif):
+        """ Update set of changed files. """
+        with self._lock:
+            if fexif.updated:
+                self._dirty.add(fexif.path)
+                # reference (not copy) - later changes of image are
+                # recorded in the same dict; image replace it by new one
+                # after save, when it is also removed from `_pending`
+                self._pending[fexif.path] = fexif.edits
+            else:
+                self._dirty.discard(fexif.path)
+                self._pending.pop(fexif.path, None)
+            self._dirty_version += 1
+            self._sort_keys.pop(fexif.path, None)
+            # indexed values may be outdated
+            self._query_index.remove(fexif.path)
+
+    def get_sort_keys(self, filename, load=True):
+        """ Get values of `SORT_TAGS` for `filename`.
+
+        Values are cached; not cached values are read from loaded image,
+        index or directly from file (by fastexif or GExiv2, without
+        creating exif.Image).
+
+        Args:
+            filename: file path
+            load: if False - return None for not cached files
+
+        Returns:
+            tuple of values (unicode or None)
+        """
+        with self._lock:
+            keys = self._sort_keys.get(filename)
+            if keys is not None:
+                return keys
+            fexif = self._exif.get(filename)
+        if fexif is not None:
+            metadata = fexif.exif
+        elif not load:
+            return None
+        else:
+            metadata = None
+        try:
+            if metadata is None and self._use_sidecar(filename) and \
+                    exif.sidecar_path(filename, True):
+                # values from sidecar are not indexed nor read by fastexif
+                metadata = exif.read_metadata(filename, True)
+            elif metadata is None and self._index is not None:
+                metadata = self._index.get(filename)
+            if metadata is None:
+                keys = tuple(_read_tags(filename, SORT_TAGS))
+            else:
+                keys = tuple(exif.read_tags(filename, SORT_TAGS, metadata))
+        except Exception, err:  # pylint: disable=W0703
+            _LOG.warn("FileList.get_sort_keys %r error: %s", filename, err)
+            keys = (None, ) * len(SORT_TAGS)
+        edits = self._pending.get(filename)
+        if edits and fexif is None:
+            # file not loaded; apply pending changes
+            keys = tuple(edits[tag] if tag in edits else key
+                         for tag, key in zip(SORT_TAGS, keys))
+        if fexif is None or not fexif.updated:
+            # values of modified images may change without notification
+            with self._lock:
+                self._sort_keys[filename] = keys
+        return keys
+
+    def invalidate(self, filename):
+        """ Forget cached data of `filename` (i.e. file was changed by
+        other application). Unsaved changes are kept and applied when file
+        is loaded again.
+
+        Returns:
+            True when file has unsaved changes
+        """
+        _LOG.debug("FileList.invalidate %r", filename)
+        with self._lock:
+            self._exif.pop(filename)
+            self._images.pop(filename)
+            self._sort_keys.pop(filename, None)
+            self._stamps.pop(filename, None)
+            self._query_index.remove(filename)
+            return filename in self._dirty
+
+    def loaded_files(self):
+        """ Get list of loaded files (cached or with unsaved changes).
+
+        Stamps of files released from cache are removed.
+        """
+        with self._lock:
+            for filename in self._stamps.keys():
+                if filename not in self._exif and \
+                        filename not in self._dirty and \
+                        filename not in self._prefetching:
+                    del self._stamps[filename]
+            return self._stamps.keys()
+
+    def changed_files(self, filenames=None):
+        """ Find files changed on disk since they were loaded or saved.
+
+        Args:
+            filenames: files to check (default: all loaded files)
+
+        Returns:
+            list of changed files
+        """
+        with self._lock:
+            if filenames is None:
+                stamps = self._stamps.items()
+            else:
+                stamps = [(fname, self._stamps[fname]) for fname in filenames
+                          if fname in self._stamps]
+        return [filename for filename, stamp in stamps
+                if self._stamp(filename) != stamp]
+
+    def refresh_changed(self, filenames=None):
+        """ Invalidate files changed on disk since they were loaded or
+        saved. Must be called in GUI thread (cached pixmaps are released).
+
+        Args:
+            filenames: files to check (default: all loaded files)
+
+        Returns:
+            dict path -> True when changed file has unsaved changes
+        """
+        return {filename: self.invalidate(filename)
+                for filename in self.changed_files(filenames)}
+
     def is_updated(self, filename):
         """ Is given `filename` updated? """
-        fexif = self._exif.get(filename)
-        return fexif and fexif.updated
+        return filename in self._dirty
 
     def copy_exif_tag(self, src, files, tags):
-        src_exif = self.get_exif(src)
-        for filename in files:
-            dst_exif = self.get_exif(filename)
-            for tag in tags:
-                value = src_exif.get_value(tag)
-                if value is not None:
-                    dst_exif.set_value(tag, value[0])
-                else:
-                    dst_exif.del_value(tag)
+        """ Copy `tags` from `src` file to `files`.
 
-    def save(self):
+        Returns:
+            dict path -> error message
+        """
+        template = templates.Template.from_image(None, self.get_exif(src),
+                                                 tags)
+        return self.apply_template(template, [fname for fname in files
+                                              if fname != src])
+
+    def apply_template(self, template, files, workers=None, progress=None):
+        """ Apply templates.Template to `files`.
+
+        Args:
+            template: template to apply
+            files: list of files
+            workers: number of threads (default: as for prefetch)
+            progress: function called in caller thread after each file with
+                (number of processed files, number of all files);
+                when returns False - remaining files are skipped.
+
+        Returns:
+            dict path -> error message
+        """
         errors = {}
-        for fexif in self._exif.itervalues():
-            if fexif.updated:
-                try:
-                    fexif.save()
-                except exif.ExifSaveError, err:
-                    errors[fexif.path] = str(err)
+        if not files:
+            return errors
+        cancelled = threading.Event()
+
+        def apply_file(filename):
+            if cancelled.is_set():
+                return filename, None
+            try:
+                template.apply(self.get_exif(filename))
+            except Exception, err:  # pylint: disable=W0703
+                _LOG.debug("FileList.apply_template(%r) error", filename,
+                           exc_info=True)
+                return filename, str(err)
+            return filename, None
+
+        pool = ThreadPool(min(workers or self._workers, len(files)))
+        try:
+            for num, (path, error) in enumerate(
+                    pool.imap_unordered(apply_file, files), 1):
+                if error:
+                    errors[path] = error
+                if progress and progress(num, len(files)) is False:
+                    cancelled.set()
+        finally:
+            pool.close()
+            pool.join()
         return errors
 
+    def save(self, workers=None, progress=None):
+        """ Save changed files.
+
+        Args:
+            workers: number of saving threads (default: as for prefetch)
+            progress: function called in caller thread after each file with
+                (number of processed files, number of all files);
+                when returns False - saving remaining files is cancelled.
+
+        Used save strategies are stored in `save_strategies`.
+
+        Returns:
+            dict path -> error message
+        """
+        to_save = list(self.iter_updated())
+        errors = {}
+        self.save_strategies = strategies = {}
+        if not to_save:
+            return errors
+        cancelled = threading.Event()
+
+        def save_file(filename):
+            if cancelled.is_set():
+                return filename, None, None
+            try:
+                # released images are loaded again with pending changes
+                fexif = self._exif.get(filename) or self._load_exif(filename)
+                strategy = fexif.save()
+            except Exception, err:  # pylint: disable=W0703
+                _LOG.debug("FileList.save(%r) error", filename,
+                           exc_info=True)
+                return filename, None, str(err)
+            with self._lock:
+                # don't treat own changes as changes by other application
+                self._stamps[filename] = self._stamp(filename)
+                self._query_index.remove(filename)
+            if self._index is not None and strategy != exif.SAVE_SIDECAR:
+                self._index.put(fexif)
+            return filename, strategy, None
+
+        pool = ThreadPool(min(workers or self._workers, len(to_save)))
+        try:
+            for num, (path, strategy, error) in enumerate(
+                    pool.imap_unordered(save_file, to_save), 1):
+                if error:
+                    errors[path] = error
+                elif strategy:
+                    strategies[path] = strategy
+                if progress and progress(num, len(to_save)) is False:
+                    _LOG.info("FileList.save: cancelled")
+                    cancelled.set()
+        finally:
+            pool.close()
+            pool.join()
+        return errors
+
+    def query(self, query, files):
+        """ Find files matching `query`.
+
+        Args:
+            query: query.Query or query text
+            files: list of files to search
+
+        Returns:
+            set of matching files
+        """
+        if not isinstance(query, mquery.Query):
+            query = mquery.Query(query)
+        index = self._query_index
+        for filename in files:
+            # changed files are indexed again as they may be changed after
+            # indexing (change of updated image is not reported)
+            with self._lock:
+                if filename in index and not self.is_updated(filename):
+                    continue
+            try:
+                fexif = self.get_exif(filename)
+            except Exception:  # pylint: disable=W0703
+                _LOG.debug("FileList.query: load %r error", filename,
+                           exc_info=True)
+                fexif = None
+            with self._lock:
+                if fexif is None:
+                    index.add_empty(filename)
+                else:
+                    index.add(fexif)
+        with self._lock:
+            return query.search(index).intersection(files)
+
     def get_pixmap(self, filename):
         """ Get pixmap for `filename` from cache. """
         return self._images.get(filename)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+""" In-place update of metadata in JPEG files.
+
+Metadata is encoded by GExiv2 into small stub file built from headers of
+the original file. When each changed metadata segment fits in space of
+the original one, new segments (padded to old size) are written over old
+ones and rest of the file is not touched.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import struct
+import logging
+import tempfile
+
+_LOG = logging.getLogger(__name__)
+
+# minimal scan (SOS header without data) and EOI closing stub file
+_EMPTY_SCAN = '\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00\xff\xd9'
+
+_XMP_PACKET_END = '<?xpacket end='
+
+
+def _segment_kind(marker, data):
+    """ Get kind of metadata stored in segment; None for other segments.
+    """
+    if marker == 0xe1:
+        if data[4:10] == 'Exif\0\0':
+            return 'exif'
+        if data[4:33] == 'http://ns.adobe.com/xap/1.0/\0':
+            return 'xmp'
+    elif marker == 0xed and data[4:18] == 'Photoshop 3.0\0':
+        return 'iptc'
+    elif marker == 0xfe:
+        return 'comment'
+    return None
+
+
+def _read_segments(ifile):
+    """ Read JPEG segments before image data.
+
+    Returns:
+        list of (kind, offset, segment data) or None when file is not
+        supported
+    """
+    if ifile.read(2) != '\xff\xd8':
+        return None
+    segments = []
+    while True:
+        offset = ifile.tell()
+        head = ifile.read(4)
+        if len(head) < 4 or head[0] != '\xff':
+            return None
+        marker = ord(head[1])
+        if marker == 0xda:  # SOS
+            return segments
+        if marker in (0x01, 0xd8, 0xd9, 0xff) or 0xd0 <= marker <= 0xd7:
+            # markers without length or fill bytes are not expected here
+            return None
+        length = struct.unpack('>H', head[2:])[0]
+        data = head + ifile.read(length - 2)
+        if length < 2 or len(data) != length + 2:
+            return None
+        segments.append((_segment_kind(marker, data), offset, data))
+
+
+def _metadata_segments(segments):
+    """ Map kind -> (offset, data) of metadata segments; None when some
+    kind occurs more than once. """
+    result = {}
+    for kind, offset, data in segments:
+        if kind:
+            if kind in result:
+                return None
+            result[kind] = (offset, data)
+    return result
+
+
+def _pad(kind, data, size):
+    """ Pad segment `data` to `size` bytes; None when not possible. """
+    extra = size - len(data)
+    if extra == 0:
+        return data
+    if extra < 0:
+        return None
+    if kind == 'exif':
+        # data after TIFF structure is ignored
+        data += '\0' * extra
+    elif kind == 'xmp':
+        pos = data.rfind(_XMP_PACKET_END)
+        if pos < 0:
+            return None
+        data = data[:pos] + ' ' * extra + data[pos:]
+    else:
+        return None
+    return data[:2] + struct.pack('>H', size - 2) + data[4:]
+
+
+def _make_patches(old, new):
+    """ Compare segments of original file and stub.
+
+    Returns:
+        list of (offset, data) to write or None when new metadata don't
+        fit in original file
+    """
+    if [data for kind, _offset, data in old if not kind] != \
+            [data for kind, _offset, data in new if not kind]:
+        return None
+    old_meta = _metadata_segments(old)
+    new_meta = _metadata_segments(new)
+    if old_meta is None or new_meta is None or \
+            set(old_meta) != set(new_meta):
+        return None
+    patches = []
+    for kind, (offset, old_data) in old_meta.iteritems():
+        new_data = new_meta[kind][1]
+        if new_data == old_data:
+            continue
+        data = _pad(kind, new_data, len(old_data))
+        if data is None:
+            _LOG.debug("_make_patches: %s segment don't fit", kind)
+            return None
+        patches.append((offset, data))
+    return patches
+
+
+def save_jpeg(metadata, path):
+    """ Save `metadata` (GExiv2.Metadata) in JPEG file `path` in place.
+
+    Returns:
+        True when file was updated; False when in-place update is not
+        possible (file is not JPEG or new metadata don't fit).
+    """
+    with open(path, 'rb') as ifile:
+        old = _read_segments(ifile)
+    if old is None:
+        return False
+    fdesc, stub = tempfile.mkstemp(suffix='.jpg')
+    try:
+        with os.fdopen(fdesc, 'wb') as ofile:
+            ofile.write('\xff\xd8')
+            for kind, _offset, data in old:
+                if not kind:
+                    ofile.write(data)
+            ofile.write(_EMPTY_SCAN)
+        metadata.save_file(stub)
+        with open(stub, 'rb') as ifile:
+            new = _read_segments(ifile)
+    finally:
+        os.remove(stub)
+    patches = None if new is None else _make_patches(old, new)
+    if patches is None:
+        return False
+    if patches:
+        with open(path, 'r+b') as ofile:
+            # check that file was not changed in meantime
+            for offset, data in patches:
+                ofile.seek(offset)
+                if ofile.read(4) != data[:4]:
+                    _LOG.warn("save_jpeg: %s changed during save", path)
+                    return False
+            for offset, data in patches:
+                ofile.seek(offset)
+                ofile.write(data)
+    return True
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+""" Persistent index of images metadata.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import logging
+import sqlite3
+import threading
+
+_LOG = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    type TEXT,
+    raw BLOB,
+    interp BLOB,
+    PRIMARY KEY (file_id, tag)
+);
+CREATE TABLE IF NOT EXISTS tag_info (
+    tag TEXT PRIMARY KEY,
+    label BLOB,
+    descr BLOB
+);
+"""
+
+
+def _blob(value):
+    return None if value is None else buffer(value)
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+class CachedMetadata(object):
+    """ Read-only metadata loaded from index.
+
+    Implement subset of GExiv2.Metadata interface used by exif.Image.
+    """
+
+    def __init__(self, index, tags):
+        self._index = index
+        self._tags = tags  # tag -> (type, raw value, interpreted value)
+
+    def __contains__(self, tag):
+        return tag in self._tags
+
+    def __getitem__(self, tag):
+        return self._tags[tag][1]
+
+    def get(self, tag, default=None):
+        item = self._tags.get(tag)
+        return default if item is None else item[1]
+
+    def get_tags(self):
+        return self._tags.keys()
+
+    def get_tag_type(self, tag):
+        return self._tags[tag][0]
+
+    def get_tag_interpreted_string(self, tag):
+        item = self._tags[tag]
+        return item[1] if item[2] is None else item[2]
+
+    def get_tag_label(self, tag):
+        return self._index.get_tag_info(tag)[0]
+
+    def get_tag_description(self, tag):
+        return self._index.get_tag_info(tag)[1]
+
+
+class MetadataIndex(object):
+    """ Index of images metadata stored in sqlite database.
+
+    Entries are identified by path, file size and modification time.
+    New entries are kept in memory and written in one transaction when
+    `BATCH_SIZE` entries are collected, on `flush` or `close`.
+
+    Args:
+        filename: database file path
+    """
+
+    # number of entries written in one transaction
+    BATCH_SIZE = 50
+
+    def __init__(self, filename):
+        _LOG.info("MetadataIndex: %s", filename)
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+        self._tag_info = {}  # tag -> (label, description)
+        # path -> (size, mtime, tags) of entries not written yet
+        self._pending = {}
+        self._pending_info = {}  # tag -> (label, description) not written
+
+    def close(self):
+        """ Write pending entries and close database. """
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def get(self, path):
+        """ Get metadata for `path`.
+
+        Returns:
+            CachedMetadata or None when file is not indexed or changed.
+        """
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is not None:
+                size, mtime, tags = pending
+                if size != fstat.st_size or mtime != fstat.st_mtime:
+                    return None
+                return CachedMetadata(
+                    self, {tag: (tag_type, _str(raw), _str(interp))
+                           for tag, tag_type, raw, interp in tags})
+            row = self._conn.execute(
+                "SELECT id, size, mtime FROM files WHERE path=?",
+                (path, )).fetchone()
+            if not row or row[1] != fstat.st_size or \
+                    row[2] != fstat.st_mtime:
+                return None
+            tags = {tag: (tag_type, _str(raw), _str(interp))
+                    for tag, tag_type, raw, interp
+                    in self._conn.execute(
+                        "SELECT tag, type, raw, interp FROM tags "
+                        "WHERE file_id=?", (row[0], ))}
+        return CachedMetadata(self, tags)
+
+    def put(self, image):
+        """ Store metadata of exif.Image `image`. """
+        try:
+            fstat = os.stat(image.path)
+        except OSError:
+            _LOG.warn("MetadataIndex.put(%r) stat error", image.path)
+            return
+        tags = list(image.get_raw_tags())
+        if not image.cached:
+            new_tags = [tag for tag, _type, _raw, _interp in tags
+                        if self.get_tag_info(tag)[0] is None]
+            if new_tags:
+                self._put_tag_info(image.exif, new_tags)
+        with self._lock:
+            self._pending[image.path] = (fstat.st_size, fstat.st_mtime, tags)
+            full = len(self._pending) >= self.BATCH_SIZE
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Write pending entries to database. """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            infos, self._pending_info = self._pending_info, {}
+            if not pending and not infos:
+                return
+            try:
+                with self._conn:
+                    for path, (size, mtime, tags) in pending.iteritems():
+                        self._conn.execute("DELETE FROM files WHERE path=?",
+                                           (path, ))
+                        file_id = self._conn.execute(
+                            "INSERT INTO files (path, size, mtime) "
+                            "VALUES (?, ?, ?)", (path, size, mtime)).lastrowid
+                        self._conn.executemany(
+                            "INSERT INTO tags (file_id, tag, type, raw, "
+                            "interp) VALUES (?, ?, ?, ?, ?)",
+                            ((file_id, tag, tag_type, _blob(raw),
+                              _blob(interp))
+                             for tag, tag_type, raw, interp in tags))
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO tag_info (tag, label, descr) "
+                        "VALUES (?, ?, ?)",
+                        ((tag, _blob(label), _blob(descr))
+                         for tag, (label, descr) in infos.iteritems()))
+            except sqlite3.Error:
+                _LOG.exception("MetadataIndex.flush error")
+
+    def remove(self, path):
+        """ Remove `path` from index. """
+        with self._lock, self._conn:
+            self._pending.pop(path, None)
+            self._conn.execute("DELETE FROM files WHERE path=?", (path, ))
+
+    def prune(self, directory):
+        """ Remove entries of not existing files from `directory`.
+
+        Returns:
+            number of removed entries
+        """
+        self.flush()
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute(
+                "SELECT path FROM files WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix))]
+        directory = os.path.dirname(prefix)  # without trailing separator
+        removed = [(path, ) for path in paths
+                   if os.path.dirname(path) == directory and
+                   not os.path.isfile(path)]
+        if removed:
+            _LOG.debug("MetadataIndex.prune(%r): %d entries", directory,
+                       len(removed))
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM files WHERE path=?",
+                                       removed)
+        return len(removed)
+
+    def get_tag_info(self, tag):
+        """ Get (label, description) for `tag`. """
+        info = self._tag_info.get(tag)
+        if info is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT label, descr FROM tag_info WHERE tag=?",
+                    (tag, )).fetchone()
+            info = (_str(row[0]), _str(row[1])) if row else (None, None)
+            self._tag_info[tag] = info
+        return info
+
+    def _put_tag_info(self, metadata, tags):
+        infos = [(tag, metadata.get_tag_label(tag),
+                  metadata.get_tag_description(tag)) for tag in tags]
+        with self._lock:
+            for tag, label, descr in infos:
+                self._tag_info[tag] = self._pending_info[tag] = (label,
+                                                                  descr)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+""" Queries on images metadata.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+
+Query syntax:
+    TAG                 tag exists
+    Exif.Photo.*        any tag with prefix exists
+    TAG OP VALUE        compare tag value; OP: = != < <= > >= ~ (contains)
+    not QUERY, QUERY and QUERY, QUERY or QUERY, (QUERY)
+
+Values that look like numbers (also rationals like 1/200) are compared
+as numbers; other values - as case-insensitive strings.
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import re
+import bisect
+import logging
+import operator
+
+_LOG = logging.getLogger(__name__)
+
+
+class QueryError(Exception):
+    pass
+
+
+def to_number(value):
+    """ Convert tag value to number; return None when not possible. """
+    if not value:
+        return None
+    value = value.split(None, 1)[0] if value.strip() else value
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if '/' in value:
+        num, den = value.split('/', 1)
+        try:
+            num, den = float(num), float(den)
+        except ValueError:
+            return None
+        return num / den if den else None
+    return None
+
+
+class QueryIndex(object):
+    """ Inverted index: tag -> values in files. """
+
+    def __init__(self):
+        self._values = {}  # tag -> {path: value}
+        self._file_tags = {}  # path -> tags
+        self._numeric = {}  # tag -> (sorted numbers, paths)
+        self._sorted_tags = None
+
+    def __contains__(self, path):
+        return path in self._file_tags
+
+    @property
+    def paths(self):
+        """ All indexed files. """
+        return set(self._file_tags)
+
+    def add(self, image):
+        """ Add or replace exif.Image `image` in index. """
+        self.remove(image.path)
+        tags = []
+        for tag in image.get_tags():
+            value = image.get_value(tag)
+            if value is None:
+                continue
+            tags.append(tag)
+            if tag not in self._values:
+                self._sorted_tags = None
+            self._values.setdefault(tag, {})[image.path] = value[0]
+            self._numeric.pop(tag, None)
+        self._file_tags[image.path] = tags
+
+    def add_empty(self, path):
+        """ Add `path` without any tags (i.e. not readable file). """
+        self.remove(path)
+        self._file_tags[path] = []
+
+    def remove(self, path):
+        """ Remove `path` from index. """
+        for tag in self._file_tags.pop(path, ()):
+            del self._values[tag][path]
+            self._numeric.pop(tag, None)
+
+    def clear(self):
+        self.__init__()
+
+    def tag_values(self, tag):
+        """ Get dict path -> value for `tag`. """
+        return self._values.get(tag) or {}
+
+    def numeric_values(self, tag):
+        """ Get (sorted numeric values, paths) for `tag`. """
+        item = self._numeric.get(tag)
+        if item is None:
+            values = sorted((num, path) for num, path
+                            in ((to_number(value), path) for path, value
+                                in self.tag_values(tag).iteritems())
+                            if num is not None)
+            item = self._numeric[tag] = ([num for num, _path in values],
+                                         [path for _num, path in values])
+        return item
+
+    def tags_with_prefix(self, prefix):
+        """ Get all indexed tags starting with `prefix`. """
+        if self._sorted_tags is None:
+            self._sorted_tags = sorted(tag for tag, values
+                                       in self._values.iteritems() if values)
+        tags = self._sorted_tags
+        pos = bisect.bisect_left(tags, prefix)
+        result = []
+        while pos < len(tags) and tags[pos].startswith(prefix):
+            result.append(tags[pos])
+            pos += 1
+        return result
+
+
+class _Exists(object):
+    def __init__(self, tag):
+        self.prefix = tag[:-1] if tag.endswith('*') else None
+        self.tag = tag
+
+    def match(self, image):
+        if self.prefix is not None:
+            return any(tag.startswith(self.prefix)
+                       for tag in image.get_tags())
+        return image.get_value(self.tag) is not None
+
+    def search(self, index):
+        if self.prefix is not None:
+            result = set()
+            for tag in index.tags_with_prefix(self.prefix):
+                result.update(index.tag_values(tag))
+            return result
+        return set(index.tag_values(self.tag))
+
+
+_STR_OPS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '~': lambda value, pattern: pattern in value,
+}
+
+
+class _Compare(object):
+    def __init__(self, tag, oper, value):
+        if tag.endswith('*'):
+            raise QueryError("prefix can't be compared: %s" % tag)
+        self.tag = tag
+        self.oper = oper
+        self.value = value
+        self.number = None if oper == '~' else to_number(value)
+        self._func = _STR_OPS[oper]
+
+    def _match_value(self, value):
+        if self.number is not None:
+            num = to_number(value)
+            return num is not None and self._func(num, self.number)
+        return self._func(value.lower(), self.value.lower())
+
+    def match(self, image):
+        value = image.get_value(self.tag)
+        return value is not None and self._match_value(value[0])
+
+    def search(self, index):
+        if self.number is None or self.oper == '!=':
+            return set(path for path, value
+                       in index.tag_values(self.tag).iteritems()
+                       if self._match_value(value))
+        nums, paths = index.numeric_values(self.tag)
+        num, oper = self.number, self.oper
+        if oper == '=':
+            return set(paths[bisect.bisect_left(nums, num):
+                             bisect.bisect_right(nums, num)])
+        if oper == '<':
+            return set(paths[:bisect.bisect_left(nums, num)])
+        if oper == '<=':
+            return set(paths[:bisect.bisect_right(nums, num)])
+        if oper == '>':
+            return set(paths[bisect.bisect_right(nums, num):])
+        return set(paths[bisect.bisect_left(nums, num):])
+
+
+class _Not(object):
+    def __init__(self, node):
+        self.node = node
+
+    def match(self, image):
+        return not self.node.match(image)
+
+    def search(self, index):
+        return index.paths - self.node.search(index)
+
+
+class _And(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def match(self, image):
+        return all(node.match(image) for node in self.nodes)
+
+    def search(self, index):
+        result = self.nodes[0].search(index)
+        for node in self.nodes[1:]:
+            if not result:
+                break
+            result &= node.search(index)
+        return result
+
+
+class _Or(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def match(self, image):
+        return any(node.match(image) for node in self.nodes)
+
+    def search(self, index):
+        result = set()
+        for node in self.nodes:
+            result |= node.search(index)
+        return result
+
+
+_TOKENS_RE = re.compile(r'\s*(?:(\()|(\))|(<=|>=|!=|=|<|>|~)|'
+                        r'"((?:[^"\\]|\\.)*)"|([^\s()<>=!~"]+))')
+
+
+def _tokenize(text):
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKENS_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise QueryError("invalid query near: %s" % text[pos:])
+        pos = match.end()
+        lpar, rpar, oper, quoted, word = match.groups()
+        if lpar:
+            yield '(', None
+        elif rpar:
+            yield ')', None
+        elif oper:
+            yield 'op', oper
+        elif quoted is not None:
+            yield 'value', re.sub(r'\\(.)', r'\1', quoted)
+        elif word.lower() in ('and', 'or', 'not'):
+            yield word.lower(), None
+        else:
+            yield 'value', word
+
+
+class Query(object):
+    """ Compiled query.
+
+    Args:
+        text: query (see module documentation)
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._tokens = list(_tokenize(text))
+        self._pos = 0
+        if not self._tokens:
+            raise QueryError("empty query")
+        self._root = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise QueryError("unexpected: %s" %
+                             (self._tokens[self._pos][1] or
+                              self._tokens[self._pos][0]))
+        del self._tokens
+
+    def match(self, image):
+        """ Check is exif.Image `image` match query. """
+        return self._root.match(image)
+
+    def search(self, index):
+        """ Find matching files in QueryIndex `index`.
+
+        Returns:
+            set of paths
+        """
+        return self._root.search(index)
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos][0]
+        return None
+
+    def _next(self):
+        if self._pos >= len(self._tokens):
+            raise QueryError("unexpected end of query")
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        nodes = [self._parse_and()]
+        while self._peek() == 'or':
+            self._next()
+            nodes.append(self._parse_and())
+        return nodes[0] if len(nodes) == 1 else _Or(nodes)
+
+    def _parse_and(self):
+        nodes = [self._parse_not()]
+        while self._peek() in ('and', 'not', '(', 'value'):
+            if self._peek() == 'and':
+                self._next()
+            nodes.append(self._parse_not())
+        return nodes[0] if len(nodes) == 1 else _And(nodes)
+
+    def _parse_not(self):
+        kind, value = self._next()
+        if kind == 'not':
+            return _Not(self._parse_not())
+        if kind == '(':
+            node = self._parse_or()
+            if self._next()[0] != ')':
+                raise QueryError("missing )")
+            return node
+        if kind != 'value':
+            raise QueryError("unexpected: %s" % (value or kind))
+        if self._peek() == 'op':
+            oper = self._next()[1]
+            kind, literal = self._next()
+            if kind != 'value':
+                raise QueryError("missing value after %s" % oper)
+            return _Compare(value, oper, literal)
+        return _Exists(value)
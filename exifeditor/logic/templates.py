@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+""" Metadata templates.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import logging
+
+_LOG = logging.getLogger(__name__)
+
+# AppConfig key: name -> {tag: value or None}
+CONFIG_KEY = 'templates'
+
+
+class Template(object):
+    """ Named set of tag operations.
+
+    Args:
+        name: template name
+        tags: dict tag -> value to set or None to delete tag
+    """
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = dict(tags)
+
+    def __repr__(self):
+        return "<Template %r; %r>" % (self.name, self.tags)
+
+    @classmethod
+    def from_image(cls, name, image, tags):
+        """ Create template with values of `tags` in exif.Image `image`;
+        tags not existing in image are deleted when template is applied.
+        """
+        values = {}
+        for tag in tags:
+            value = image.get_value(tag)
+            values[tag] = None if value is None else value[0]
+        return cls(name, values)
+
+    def apply(self, image):
+        """ Apply template to exif.Image `image`.
+
+        Returns:
+            True when image was changed.
+        """
+        for tag, value in self.tags.iteritems():
+            if value is None:
+                image.del_value(tag)
+            else:
+                image.set_value(tag, value)
+        return image.updated
+
+
+def load_templates(config):
+    """ Load templates from AppConfig `config`.
+
+    Returns:
+        dict name -> Template
+    """
+    return {name: Template(name, tags)
+            for name, tags in (config.get(CONFIG_KEY) or {}).iteritems()}
+
+
+def save_template(config, template):
+    """ Store `template` in AppConfig `config`. """
+    templates = dict(config.get(CONFIG_KEY) or {})
+    templates[template.name] = template.tags
+    config[CONFIG_KEY] = templates
+
+
+def delete_template(config, name):
+    """ Remove template `name` from AppConfig `config`. """
+    templates = dict(config.get(CONFIG_KEY) or {})
+    templates.pop(name, None)
+    config[CONFIG_KEY] = templates
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+""" Polling watcher for changes of loaded files.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import logging
+import threading
+
+_LOG = logging.getLogger(__name__)
+
+
+class PollingWatcher(object):
+    """ Periodically check files loaded by FileList.
+
+    Used when system notifications (inotify) are not available. Changed
+    files are only reported; they should be invalidated by
+    FileList.refresh_changed in GUI thread.
+
+    Args:
+        filelist: watched filelist.FileList
+        interval: time between checks in seconds
+        callback: function called (in watcher thread) with list of changed
+            files
+    """
+
+    def __init__(self, filelist, interval, callback):
+        self._filelist = filelist
+        self._interval = interval
+        self._callback = callback
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="PollingWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                changes = self._filelist.changed_files()
+            except Exception:  # pylint: disable=W0703
+                _LOG.exception("PollingWatcher: check error")
+                continue
+            if changes:
+                _LOG.info("PollingWatcher: changed files: %r", changes)
+                self._callback(changes)
+
+    def close(self):
+        """ Stop watching. """
+        self._stop.set()
+        self._thread.join()
@@ -23,9 +23,22 @@ from exifeditor import version
 
 def _parse_opt():
     """ Parse cli options. """
-    optp = optparse.OptionParser(usage="%prog [options] [startup dir]",
+    optp = optparse.OptionParser(usage="%prog [options] [startup dir]\n"
+                                 "       %prog --batch [options] COMMAND "
+                                 "[ARGS]",
                                  version=version.NAME + version.VERSION,
                                  description="Simple exif editor")
+    group = optparse.OptionGroup(optp, "Batch mode (without GUI)")
+    group.add_option("--batch", action="store_true", default=False,
+                     help="run batch command; use --batch help for list "
+                     "of commands")
+    group.add_option("--recursive", "-r", action="store_true", default=False,
+                     help="process files in subdirectories")
+    group.add_option("--workers", type="int", default=4,
+                     help="number of worker threads (default 4)")
+    group.add_option("--dry-run", action="store_true", default=False,
+                     help="don't save changes")
+    optp.add_option_group(group)
     group = optparse.OptionGroup(optp, "Debug options")
     group.add_option("--debug", "-d", action="store_true", default=False,
                      help="enable debug messages")
@@ -33,6 +46,11 @@ def _parse_opt():
                      help="enable debug messages in PyQt4 namespace")
     group.add_option("--shell", action="store_true", default=False,
                      help="start shell")
+    group.add_option("--profile", action="store_true", default=False,
+                     help="measure time of main operations; write summary "
+                     "to log on exit")
+    group.add_option("--profile-dump", metavar="FILE",
+                     help="run under cProfile and write stats to FILE")
     optp.add_option_group(group)
     return optp.parse_args()
 
@@ -59,6 +77,12 @@ def run():
     from exifeditor.lib import locales
     locales.setup_locale(config)
 
+    if options.batch:
+        # batch mode - don't import PyQt
+        from exifeditor.logic import batch
+        sys.exit(batch.run(args, options.recursive, options.workers,
+                           options.dry_run))
+
     if options.shell:
         # starting interactive shell
         from IPython.terminal import ipapp
@@ -67,6 +91,15 @@ def run():
         app.start()
         return
 
+    profiler = None
+    if options.profile or options.profile_dump:
+        from exifeditor.lib import profiling
+        profiling.enable()
+        if options.profile_dump:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
     from PyQt4 import QtGui
     app = QtGui.QApplication(sys.argv)
 
@@ -77,3 +110,10 @@ def run():
     app.exec_()
 
     config.save()
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(options.profile_dump)
+        _LOG.info("Profile stats written to %s", options.profile_dump)
+    if options.profile or options.profile_dump:
+        profiling.log_summary()
@@ -50,11 +50,15 @@ setup(
     download_url='',
     license='GPL v3',
     py_modules=['exifeditor', 'exifeditor_dbg'],
-    packages=find_packages('.'),
+    packages=find_packages('.', exclude=['benchmarks', 'tests']),
     package_dir={'': '.'},
     include_package_data=True,
     # data_files=list(get_data_files()),
     install_requires=REQUIRES,
+    extras_require={
+        # faster listing of large directories
+        'scandir': ['scandir'],
+    },
     entry_points="""
        [console_scripts]
        exifeditor = exifeditor.main:run
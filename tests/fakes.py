@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+""" Simple in-memory replacement of GExiv2 used by tests.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import json
+
+from exifeditor.logic import exif
+
+_ARRAY_TAGS = ('Xmp.dc.creator', )
+_LANGALT_TAGS = ('Xmp.dc.description', 'Xmp.dc.rights')
+
+
+class Metadata(object):
+    """ Metadata of image files are kept in `FILES`; xmp sidecars are
+    stored as json files. """
+
+    FILES = {}  # path -> {tag: value}
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.xmp'):
+            with open(path) as ifile:
+                data = ifile.read()
+            tags = json.loads(data) if data.startswith('{') else {}
+            self._tags = {str(tag): (map(str, value)
+                                     if isinstance(value, list)
+                                     else str(value))
+                          for tag, value in tags.iteritems()}
+        else:
+            self._tags = dict(self.FILES.get(path, {}))
+
+    def __contains__(self, tag):
+        return tag in self._tags
+
+    def __getitem__(self, tag):
+        value = self._tags[tag]
+        return ', '.join(value) if isinstance(value, list) else value
+
+    def __setitem__(self, tag, value):
+        value = value.encode('utf-8') if isinstance(value, unicode) \
+            else str(value)
+        if tag in _ARRAY_TAGS:
+            value = self._tags.get(tag, []) + [value]
+        self._tags[tag] = value
+
+    def __delitem__(self, tag):
+        del self._tags[tag]
+
+    def get(self, tag, default=None):
+        return self[tag] if tag in self._tags else default
+
+    def get_tags(self):
+        return sorted(self._tags)
+
+    def get_xmp_tags(self):
+        return [tag for tag in self.get_tags() if tag.startswith('Xmp.')]
+
+    def get_tag_type(self, tag):
+        if tag in _ARRAY_TAGS:
+            return 'XmpSeq'
+        if tag in _LANGALT_TAGS:
+            return 'LangAlt'
+        return 'XmpText' if tag.startswith('Xmp.') else 'Ascii'
+
+    def get_tag_interpreted_string(self, tag):
+        return self[tag]
+
+    def get_tag_label(self, tag):
+        return tag.rsplit('.', 1)[-1]
+
+    def get_tag_description(self, tag):
+        return 'Description of ' + tag
+
+    def get_tag_multiple(self, tag):
+        value = self._tags[tag]
+        return list(value) if isinstance(value, list) else [value]
+
+    def set_tag_multiple(self, tag, values):
+        self._tags[tag] = list(values)
+
+    def get_preview_properties(self):
+        return []
+
+    def save_file(self, path=None):
+        if self.path.endswith('.xmp'):
+            with open(path or self.path, 'w') as ofile:
+                json.dump(self._tags, ofile)
+        else:
+            self.FILES[path or self.path] = dict(self._tags)
+
+
+class GExiv2(object):
+    Metadata = Metadata
+
+
+def install():
+    """ Use fake GExiv2 in exif module; return function restoring
+    original. """
+    orig = exif._GEXIV2  # pylint: disable=W0212
+    Metadata.FILES = {}
+    exif._GEXIV2 = GExiv2  # pylint: disable=W0212
+
+    def restore():
+        exif._GEXIV2 = orig  # pylint: disable=W0212
+    return restore
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+""" Smoke tests for benchmarks.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import compare, corpus, run
+from tests import fakes
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+        self._restore()
+
+    def test_run_logic(self):
+        files = corpus.generate(self._dir, files=4, tags=3, width=8,
+                                height=8, formats=('tif', ))
+        self.assertEqual(len(files), 4)
+        results = run.Benchmark(files, repeat=2).run_logic()
+        self.assertEqual(sorted(results),
+                         ['filelist_copy_exif_tag', 'filelist_save',
+                          'get_value_all_tags', 'image_init',
+                          'read_tags_fastexif', 'read_tags_gexiv2'])
+        for stats in results.itervalues():
+            self.assertEqual(stats['runs'], 2)
+            self.assertLessEqual(stats['min'], stats['median'])
+        # values copied from first file are saved
+        saved = fakes.Metadata.FILES[files[-1]]
+        self.assertTrue(saved['Exif.Image.Artist'].startswith('bench '))
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_compare(self):
+        old = {'results': {'a': {'median': 2.0}, 'b': {'median': 1.0}}}
+        new = {'results': {'a': {'median': 1.0}, 'c': {'median': 3.0}}}
+        self.assertEqual(compare.compare(old, new),
+                         [('a', 2.0, 1.0, 0.5), ('b', 1.0, None, None),
+                          ('c', None, 3.0, None)])
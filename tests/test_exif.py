@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+""" Tests for recording changes of images.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from exifeditor.logic import exif, filelist
+from tests import fakes
+
+
+class EditsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._dir, 'image.jpg')
+        with open(self.path, 'wb') as ofile:
+            ofile.write('jpeg data')
+        fakes.Metadata.FILES[self.path] = {
+            'Exif.Image.Artist': 'artist',
+            'Exif.Image.Model': 'D700',
+        }
+
+    def tearDown(self):
+        self._restore()
+        shutil.rmtree(self._dir)
+
+    def test_same_value(self):
+        image = exif.Image(self.path)
+        self.assertFalse(image.set_value('Exif.Image.Model', 'D700'))
+        self.assertFalse(image.set_value('Exif.Image.Artist', u'artist'))
+        self.assertFalse(image.updated)
+        self.assertEqual(image.edits, {})
+        self.assertTrue(image.set_value('Exif.Image.Model', 'D800'))
+        self.assertEqual(image.edits, {'Exif.Image.Model': 'D800'})
+
+    def test_pending_edits(self):
+        flist = filelist.FileList(1, exif_cache_entries=1)
+        try:
+            image = flist.get_exif(self.path)
+            image.set_value('Exif.Image.Model', 'D800')
+            # change after image is marked as updated
+            image.set_value('Exif.Image.Artist', 'other')
+            flist.invalidate(self.path)
+            image = flist.get_exif(self.path)
+            self.assertTrue(image.updated)
+            self.assertEqual(image.exif['Exif.Image.Model'], 'D800')
+            self.assertEqual(image.exif['Exif.Image.Artist'], 'other')
+        finally:
+            flist.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+def _jpeg(width, height, segments=''):
+    """ Minimal JPEG data with SOF0 segment. """
+    return ('\xff\xd8' + segments + '\xff\xc0' +
+            struct.pack('>HBHHB', 11, 8, height, width, 1) +
+            '\x01\x11\x00\xff\xd9')
+
+
+class PreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._dir, 'image.jpg')
+        self.thumb = _jpeg(160, 120)
+        # IFD0 with Make tag, IFD1 with thumbnail
+        tiff = 'II*\x00' + struct.pack('<I', 8)
+        tiff += struct.pack('<HHHI4sI', 1, 0x010f, 2, 4, 'Abc\x00', 26)
+        tiff += struct.pack('<HHHIIHHIII', 2, 0x0201, 4, 1, 56,
+                            0x0202, 4, 1, len(self.thumb), 0)
+        tiff += self.thumb
+        app1 = '\xff\xe1' + struct.pack('>H', 8 + len(tiff)) + \
+            'Exif\x00\x00' + tiff
+        with open(self.path, 'wb') as ofile:
+            ofile.write(_jpeg(1600, 1200, app1))
+
+    def tearDown(self):
+        self._restore()
+        shutil.rmtree(self._dir)
+
+    def test_thumbnail(self):
+        image = exif.Image(self.path)
+        self.assertEqual(image.get_preview(100, 100),
+                         ('image/jpeg', self.thumb))
+        self.assertIsNone(image.get_preview(200, 100))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+""" Tests for filelist module.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from exifeditor.logic import filelist
+from tests import fakes
+
+
+class ScanImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        for name in ('a.jpg', 'b.NEF', 'c.txt'):
+            with open(os.path.join(self._dir, name), 'w') as ofile:
+                ofile.write('x')
+        os.mkdir(os.path.join(self._dir, 'dir.jpg'))
+        os.symlink(os.path.join(self._dir, 'a.jpg'),
+                   os.path.join(self._dir, 'link.jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _check(self):
+        self.assertEqual(sorted(filelist.scan_images(self._dir)),
+                         ['a.jpg', 'b.NEF'])
+
+    def test_scan(self):
+        self._check()
+
+    def test_scan_without_scandir(self):
+        orig = filelist._scandir  # pylint: disable=W0212
+        filelist._scandir = None  # pylint: disable=W0212
+        try:
+            self._check()
+        finally:
+            filelist._scandir = orig  # pylint: disable=W0212
+
+
+class ChangedFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+        self.files = []
+        for name in ('a.jpg', 'b.jpg'):
+            path = os.path.join(self._dir, name)
+            with open(path, 'w') as ofile:
+                ofile.write('x')
+            fakes.Metadata.FILES[path] = {'Exif.Image.Model': 'D700'}
+            self.files.append(path)
+        self.flist = filelist.FileList(1, exif_cache_entries=1)
+
+    def tearDown(self):
+        self.flist.close()
+        self._restore()
+        shutil.rmtree(self._dir)
+
+    def test_released_files_not_tracked(self):
+        first, second = self.files
+        self.flist.get_exif(first)
+        self.flist.get_exif(second)
+        # first is released from cache
+        self.assertEqual(self.flist.loaded_files(), [second])
+
+    def test_changed_file(self):
+        first, second = self.files
+        self.flist.get_exif(first).set_value('Exif.Image.Model', 'D800')
+        self.flist.get_exif(second)
+        with open(first, 'w') as ofile:
+            ofile.write('changed')
+        self.assertEqual(self.flist.changed_files(), [first])
+        self.assertEqual(self.flist.refresh_changed(), {first: True})
+        self.assertEqual(self.flist.loaded_files(), [second])
+        # unsaved changes are applied to new version
+        image = self.flist.get_exif(first)
+        self.assertEqual(image.exif['Exif.Image.Model'], 'D800')
+
+
+if __name__ == '__main__':
+    unittest.main()
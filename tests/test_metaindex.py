@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" Tests for persistent metadata index.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from exifeditor.logic import exif, metaindex
+from tests import fakes
+
+
+class MetadataIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self._dir, 'index.db')
+        self.files = []
+        for name in ('a.jpg', 'b.jpg'):
+            path = os.path.join(self._dir, name)
+            with open(path, 'w') as ofile:
+                ofile.write('x')
+            fakes.Metadata.FILES[path] = {'Exif.Image.Model': name}
+            self.files.append(path)
+
+    def tearDown(self):
+        self._restore()
+        shutil.rmtree(self._dir)
+
+    def _put_all(self, index):
+        for path in self.files:
+            index.put(exif.Image(path))
+
+    def test_pending_entries(self):
+        index = metaindex.MetadataIndex(self.dbfile)
+        self._put_all(index)
+        # not written yet but available
+        self.assertEqual(index.get(self.files[0]).get('Exif.Image.Model'),
+                         'a.jpg')
+        index.close()
+        index = metaindex.MetadataIndex(self.dbfile)
+        self.assertEqual(index.get(self.files[1]).get('Exif.Image.Model'),
+                         'b.jpg')
+        index.close()
+
+    def test_changed_file(self):
+        index = metaindex.MetadataIndex(self.dbfile)
+        self._put_all(index)
+        with open(self.files[0], 'w') as ofile:
+            ofile.write('changed')
+        self.assertIsNone(index.get(self.files[0]))
+        index.close()
+
+    def test_prune(self):
+        index = metaindex.MetadataIndex(self.dbfile)
+        self._put_all(index)
+        os.remove(self.files[0])
+        self.assertEqual(index.prune(self._dir), 1)
+        self.assertEqual(index.prune(self._dir + os.sep), 0)
+        self.assertIsNotNone(index.get(self.files[1]))
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" Tests for saving changes in xmp sidecar files.
+
+Copyright (c) Karol Będkowski, 2014
+
+This file is part of exifeditor
+Licence: GPLv2+
+"""
+
+__author__ = u"Karol Będkowski"
+__copyright__ = u"Copyright (c) Karol Będkowski, 2014"
+__version__ = "2014-12-28"
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from exifeditor.logic import exif
+from tests import fakes
+
+
+class SidecarTest(unittest.TestCase):
+
+    def setUp(self):
+        self._restore = fakes.install()
+        self._dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._dir, 'image.nef')
+        with open(self.path, 'wb') as ofile:
+            ofile.write('raw data')
+        fakes.Metadata.FILES[self.path] = {
+            'Exif.Image.Artist': 'old artist',
+            'Exif.Image.Model': 'D700',
+            'Exif.Photo.FNumber': '28/10',
+        }
+
+    def tearDown(self):
+        self._restore()
+        shutil.rmtree(self._dir)
+
+    def _save(self, image):
+        self.assertEqual(image.save(), exif.SAVE_SIDECAR)
+        self.assertFalse(image.updated)
+        # image file is not changed
+        self.assertEqual(fakes.Metadata.FILES[self.path]['Exif.Photo.FNumber'],
+                         '28/10')
+        self.assertTrue(os.path.isfile(self.path + '.xmp'))
+
+    def test_group_mapped_tag(self):
+        image = exif.Image(self.path)
+        self.assertTrue(image.sidecar)
+        image.set_value('Exif.Photo.FNumber', '40/10')
+        self._save(image)
+        image = exif.Image(self.path)
+        self.assertEqual(image.exif.get('Exif.Photo.FNumber'), '40/10')
+        self.assertEqual(image.exif.get('Xmp.exif.FNumber'), '40/10')
+
+    def test_table_mapped_tags(self):
+        image = exif.Image(self.path)
+        image.artist = u'new artist'
+        image.datetime = '2014:12:28 10:11:12'
+        self._save(image)
+        image = exif.Image(self.path)
+        self.assertEqual(image.artist, u'new artist')
+        self.assertEqual(image.datetime, '2014:12:28 10:11:12')
+        self.assertEqual(image.exif.get('Xmp.xmp.ModifyDate'),
+                         '2014-12-28T10:11:12')
+
+    def test_delete_tag(self):
+        image = exif.Image(self.path)
+        image.del_value('Exif.Image.Model')
+        image.set_value('Exif.Photo.FNumber', '40/10')
+        self._save(image)
+        image = exif.Image(self.path)
+        self.assertNotIn('Exif.Image.Model', image.exif)
+        self.assertEqual(image.exif.get('Exif.Photo.FNumber'), '40/10')
+
+    def test_unsupported_tag(self):
+        image = exif.Image(self.path)
+        self.assertRaises(exif.ExifUpdateError, image.set_value,
+                          'Exif.GPSInfo.GPSLatitude', '1/1')
+        self.assertFalse(image.updated)
+        self.assertEqual(image.edits, {})
+
+
+if __name__ == '__main__':
+    unittest.main()